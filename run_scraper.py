@@ -1,20 +1,30 @@
 import os
 import asyncio
+import signal
+import argparse
 import logging
-from collections import deque
+import multiprocessing
 from functools import partial
+from contextlib import AsyncExitStack
+from multiprocessing.util import Finalize
 from sqlmodel import create_engine
 from src.tools.config import settings
 from src.tools.service import ScraperService
+from src.tools.media_store import get_media_index_path
+from src.tools.rate_limiter import TokenBucketRateLimiter, get_rate_limit_db_path
+from src.tools.html_archive import HtmlArchive, get_html_archive_dir
 from src.Exception.logger_config import setup_logging
 from src.Exception.exceptions import CustomScrapingError
 from src.tele_bot.telegram_notifier import TelegramNotifier
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta, date as date_type
-from src.tools.database import get_session, ensure_partition_exists, setup_database_schema
-from src.tools.state_manager import (init_db, load_scrape_state, save_page_state, load_control_state,
-                                     save_control_state, get_db_path, clear_page_state_for_day,
-                                     get_all_in_progress_days)
+from src.tools.database import get_offloaded_session, partition_registry, setup_database_schema
+from src.tools.metrics import WORK_UNITS, WORKERS_BUSY, mark_process_dead, reset_metrics_dir
+from src.tools.tracing import export_chrome_trace, flush_trace, reset_trace_dir, span
+from src.tools.work_queue import LocalWorkQueue, PostgresWorkQueue, WorkUnit, split_page_range
+from src.tools.state_manager import (init_db, load_scrape_state, save_page_state, flush_page_states, load_control_state,
+                                     get_db_path, clear_page_state_for_day,
+                                     get_all_in_progress_days, record_page_metrics)
 
 LOG_OUTPUT_DIR_PATH = "/home/minhdangpy134/Logvntmtool"
 try:
@@ -28,51 +38,168 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 MEDIA_PHYSICAL_DIR = os.path.join(PROJECT_ROOT, "media_root", "brand_images")
 os.makedirs(MEDIA_PHYSICAL_DIR, exist_ok=True)
 logging.info(f"Thư mục lưu trữ media: {MEDIA_PHYSICAL_DIR}")
+MEDIA_INDEX_PATH = get_media_index_path(PROJECT_ROOT)
+RATE_LIMIT_DB_PATH = get_rate_limit_db_path(PROJECT_ROOT)
+HTML_ARCHIVE_DIR = get_html_archive_dir(PROJECT_ROOT)
 STATE_DB_PATH = get_db_path(PROJECT_ROOT)
 init_db(STATE_DB_PATH)
 RUN_DURATION_SECONDS = settings.RUN_DURATION_MINUTES * 60
 PAUSE_DURATION_SECONDS = settings.PAUSE_DURATION_MINUTES * 60
 NUM_PROCESSES = settings.CONCURRENT_SCRAPING_TASKS
+# Khi còn slot trống, manager kiểm tra lại hàng đợi sau mỗi khoảng này để nhận các khoảng trang vừa được chia
+IDLE_SLOT_POLL_SECONDS = 5
+
+
+_worker_context = None
+
+
+def build_worker_context(db_url: str, media_physical_dir_worker: str, offline: bool = False,
+                         db_pool_size: int = None, loop: asyncio.AbstractEventLoop = None,
+                         parse_executor=None, offload_db_calls: bool = False, stop_event=None) -> dict:
+    worker_engine = create_engine(db_url, pool_pre_ping=True, pool_size=db_pool_size or settings.WORKER_DB_POOL_SIZE,
+                                  max_overflow=0)
+    rate_limiter = None
+    if settings.RATE_LIMITER_ENABLED and not offline:
+        rate_limiter = TokenBucketRateLimiter.from_settings(RATE_LIMIT_DB_PATH)
+    html_archive = HtmlArchive(HTML_ARCHIVE_DIR) if (settings.HTML_ARCHIVE_ENABLED or offline) else None
+    scraper = ScraperService(media_dir=media_physical_dir_worker, media_index_path=MEDIA_INDEX_PATH,
+                             rate_limiter=rate_limiter, html_archive=html_archive, offline=offline,
+                             parse_executor=parse_executor, offload_db_calls=offload_db_calls)
+    if loop is None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return {"pid": os.getpid(), "offline": offline, "engine": worker_engine, "scraper": scraper, "loop": loop,
+            "stop_event": stop_event}
+
+
+def close_worker_context(context: dict) -> None:
+    loop = context["loop"]
+    try:
+        loop.run_until_complete(context["scraper"].close())
+    finally:
+        loop.close()
+        context["engine"].dispose()
+
+
+def init_scrape_worker(db_url: str, media_physical_dir_worker: str, offline: bool = False, stop_event=None):
+    """Initializer của ProcessPoolExecutor: mỗi process giữ một engine, một ScraperService và một event loop cho mọi ngày."""
+    global _worker_context
+    _worker_context = build_worker_context(db_url, media_physical_dir_worker, offline, stop_event=stop_event)
+    if stop_event is not None:
+        # SIGTERM gửi thẳng tới worker cũng chỉ yêu cầu dừng sau trang hiện tại, không cắt ngang transaction;
+        # Ctrl+C (SIGINT tới cả nhóm process) do manager xử lý và báo lại qua stop_event
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Finalize(None, close_worker_context, args=(_worker_context,), exitpriority=10)
+    Finalize(None, mark_process_dead, args=(os.getpid(),), exitpriority=5)
+    Finalize(None, flush_trace, exitpriority=5)
+    logging.info(f"Worker process {os.getpid()} đã khởi tạo engine, ScraperService và event loop dùng lại.")
+
+
+def scrape_day_worker(current_day_to_process: date_type, db_url: str, media_physical_dir_worker: str,
+                      offline: bool = False, tail: bool = False):
+    return scrape_unit_worker(WorkUnit(current_day_to_process), db_url, media_physical_dir_worker, offline, tail)
+
+
+def scrape_unit_worker(unit: WorkUnit, db_url: str, media_physical_dir_worker: str, offline: bool = False,
+                       tail: bool = False, queue_owner: str = None):
+    # Dùng context của process nếu đã có initializer, ngược lại tạo tạm cho riêng đơn vị việc này
+    is_persistent_context = (_worker_context is not None and _worker_context["pid"] == os.getpid()
+                             and _worker_context["offline"] == offline)
+    context = _worker_context if is_persistent_context else None
+    try:
+        if context is None:
+            context = build_worker_context(db_url, media_physical_dir_worker, offline)
+        return context["loop"].run_until_complete(process_unit(unit, context, offline, tail, queue_owner))
+    finally:
+        if not is_persistent_context and context is not None:
+            close_worker_context(context)
 
 
-def scrape_day_worker(current_day_to_process: date_type, db_url: str, media_physical_dir_worker: str):
+async def process_unit(unit: WorkUnit, context: dict, offline: bool = False, tail: bool = False,
+                       queue_owner: str = None) -> dict:
+    """Cào một đơn vị việc bằng engine/ScraperService của context; dùng chung cho worker process và chế độ asyncio.
+
+    offline: đọc lại từ html_archive; tail: quét lại ngày gần đây từ trang 1 và dừng ở trang toàn số đơn đã biết.
+    Cả hai chế độ này không đọc/ghi checkpoint của lần cào chính.
+    queue_owner: chủ lease của manager đã claim đơn vị này (hàng đợi PostgreSQL), dùng để ghi checkpoint chung.
+    """
+    current_day_to_process = unit.day
     log = logging.getLogger(f"Worker-{current_day_to_process.strftime('%Y-%m-%d')}")
-    log.info(f"Bắt đầu xử lý ngày: {current_day_to_process}")
+    log.info(f"Bắt đầu xử lý: {unit.label()}{' (offline)' if offline else ''}{' (tail)' if tail else ''}")
     last_processed_page = 0
+    unit_status = "worker_crash"
+    WORKERS_BUSY.inc()
+    track_state = not offline and not tail
+    # Hàng đợi chung: checkpoint chỉ ghi vào Postgres (dưới lease của manager) để máy khác nhận lại đơn vị này
+    # tiếp tục đúng trang; page_state SQLite của máy này không được dùng
+    shared_queue = None
+    if settings.WORK_QUEUE_BACKEND == "postgres" and track_state:
+        shared_queue = PostgresWorkQueue(context["engine"], owner=queue_owner)
+    track_local_state = track_state and shared_queue is None
+
+    def publish_split(first_page: int, page_count: int):
+        # Đưa ngay các trang còn lại của ngày vào hàng đợi bền vững: worker khác bắt đầu song song, và đơn vị đầu
+        # bị dừng/crash cũng không làm mất việc chia trang
+        remaining_units = split_page_range(current_day_to_process, first_page, page_count, settings.PAGES_PER_WORK_UNIT)
+        (shared_queue or LocalWorkQueue(STATE_DB_PATH)).put_many(remaining_units)
+        log.info(f"Chia trang {first_page}-{page_count} thành {len(remaining_units)} đơn vị: "
+                 f"{[remaining_unit.label() for remaining_unit in remaining_units]}")
 
     def state_updater_in_memory(page_just_completed: int):
         nonlocal last_processed_page
         last_processed_page = page_just_completed
         log.info(f"Đã xử lý xong trang {page_just_completed}")
-        save_page_state(STATE_DB_PATH, day_key, page_just_completed)
-
+        # Chạy lại từ archive hoặc quét tail không đụng tới trạng thái cào chính
+        if track_local_state:
+            save_page_state(STATE_DB_PATH, day_key, page_just_completed,
+                            flush_interval_seconds=settings.STATE_FLUSH_INTERVAL_SECONDS,
+                            max_pending_pages=settings.STATE_FLUSH_MAX_PENDING_PAGES)
+        if shared_queue is not None:
+            shared_queue.save_checkpoint(unit, page_just_completed)
+
+    def page_metrics_recorder(page_metrics: dict):
+        record_page_metrics(STATE_DB_PATH, page_metrics)
+
+    # Ở chế độ asyncio mọi đơn vị việc dùng chung một event loop: các lời gọi DB/SQLite đồng bộ (DDL partition,
+    # checkpoint, commit) chạy qua scraper.run_db để không chặn các đơn vị khác
+    scraper = context["scraper"]
     try:
-        worker_engine = create_engine(db_url, pool_pre_ping=True)
-        scraper = ScraperService(media_dir=media_physical_dir_worker)
-        day_key = f"brands_{current_day_to_process.strftime('%Y-%m-%d')}_{current_day_to_process.strftime('%Y-%m-%d')}"
-
-        initial_page_for_this_day = load_scrape_state(STATE_DB_PATH, day_key)
-
-        scrape_result = {}
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            dt_for_partition = datetime.combine(current_day_to_process, datetime.min.time())
-            ensure_partition_exists(dt_for_partition, worker_engine)
-            with get_session(worker_engine) as session:
-                scrape_result = loop.run_until_complete(scraper.scrape_by_date_range(
+        worker_engine = context["engine"]
+        stop_event = context.get("stop_event")
+        day_key = unit.state_key
+
+        initial_page_for_this_day = unit.start_page
+        if track_local_state:
+            initial_page_for_this_day = await scraper.run_db(
+                partial(load_scrape_state, STATE_DB_PATH, day_key, default_page=unit.start_page))
+        if shared_queue is not None:
+            shared_checkpoint = await scraper.run_db(shared_queue.load_checkpoint, unit)
+            if shared_checkpoint:
+                initial_page_for_this_day = max(initial_page_for_this_day, shared_checkpoint + 1)
+
+        dt_for_partition = datetime.combine(current_day_to_process, datetime.min.time())
+        await scraper.run_db(partition_registry.ensure, dt_for_partition, worker_engine)
+        async with get_offloaded_session(scraper.run_db, worker_engine) as session:
+            with span("unit", unit=unit.label(), offline=offline, tail=tail):
+                scrape_result = await scraper.scrape_by_date_range(
                     start_date=current_day_to_process,
                     end_date=current_day_to_process,
                     session=session,
                     initial_start_page=initial_page_for_this_day,
-                    state_save_callback=state_updater_in_memory
-                ))
-        finally:
-            loop.close()
-
-        log.info(f"Hoàn thành xử lý ngày {current_day_to_process} với kết quả: {scrape_result.get('status')}")
+                    state_save_callback=state_updater_in_memory,
+                    end_page=unit.end_page,
+                    split_pages=settings.PAGES_PER_WORK_UNIT if track_state and unit.is_whole_day else 0,
+                    split_callback=publish_split,
+                    stop_requested=stop_event.is_set if stop_event is not None else None,
+                    stop_on_known_page=tail,
+                    page_metrics_callback=page_metrics_recorder if settings.PAGE_METRICS_ENABLED else None
+                )
+
+        log.info(f"Hoàn thành xử lý {unit.label()} với kết quả: {scrape_result.get('status')}")
+        unit_status = scrape_result.get("status", "unknown_error")
         scrape_result['last_processed_page'] = last_processed_page
-        return {"date": current_day_to_process, "result": scrape_result}
+        return {"date": current_day_to_process, "unit": unit, "result": scrape_result}
 
     except CustomScrapingError as cse:
         import traceback
@@ -91,7 +218,7 @@ def scrape_day_worker(current_day_to_process: date_type, db_url: str, media_phys
             "last_processed_page": cse.page - 1 if cse.page > 0 else 0,
             "brands_processed_count": 0
         }
-        return {"date": current_day_to_process, "result": error_details}
+        return {"date": current_day_to_process, "unit": unit, "result": error_details}
 
     except Exception as e:
         import traceback
@@ -111,11 +238,17 @@ def scrape_day_worker(current_day_to_process: date_type, db_url: str, media_phys
             "last_processed_page": last_processed_page,
             "brands_processed_count": 0
         }
-        return {"date": current_day_to_process, "result": error_details}
+        return {"date": current_day_to_process, "unit": unit, "result": error_details}
 
     finally:
-        if 'worker_engine' in locals() and worker_engine:
-            worker_engine.dispose()
+        # Manager đọc/xóa page_state ngay khi nhận kết quả nên checkpoint đang gom phải được ghi trước khi trả về;
+        # số liệu trang (page_metrics) được ghi cùng lượt, kể cả khi chạy offline/tail
+        if track_state or settings.PAGE_METRICS_ENABLED:
+            await scraper.run_db(flush_page_states, STATE_DB_PATH)
+        WORKERS_BUSY.dec()
+        WORK_UNITS.labels(unit_status).inc()
+        # Ghi span của đơn vị việc xuống file ngay để manager gộp được trace khi kết thúc
+        flush_trace()
 
 
 def get_next_sequential_day_to_process() -> date_type:
@@ -144,6 +277,17 @@ def get_next_sequential_day_to_process() -> date_type:
     return start_date
 
 
+def precreate_partitions(start_day: date_type, end_day: date_type) -> None:
+    # Chạy ở manager trước khi tạo pool: worker fork ra thừa hưởng registry đã nạp, không cần truy vấn catalog mỗi ngày
+    engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+    try:
+        partition_registry.ensure_range(start_day, end_day, engine)
+    except Exception as e:
+        logging.error(f"Lỗi khi tạo trước partition: {e}. Worker sẽ tự kiểm tra theo từng ngày.", exc_info=True)
+    finally:
+        engine.dispose()
+
+
 def get_overall_end_date() -> date_type:
     if settings.OVERALL_SCRAPE_END_YEAR and settings.OVERALL_SCRAPE_END_MOTH and settings.OVERALL_SCRAPE_END_DAY:
         try:
@@ -158,117 +302,236 @@ def get_overall_end_date() -> date_type:
     return datetime.now().date() - timedelta(days=1)
 
 
+def handle_worker_result(unit: WorkUnit, future, work_queue: LocalWorkQueue) -> None:
+    processed_date = unit.day
+    try:
+        worker_output = future.result()
+        result_data = worker_output.get("result", {})
+        scrape_status = result_data.get("status", "unknown_error")
+
+        logging.info(
+            f"Worker cho {unit.label()} đã HOÀN THÀNH. Status: {scrape_status}")
+
+        if scrape_status in ["completed_all_pages", "no_data_on_first_page", "completed_range"]:
+            work_queue.complete(unit)
+            if not work_queue.day_has_open_units(processed_date):
+                logging.info(
+                    f"✅ HOÀN TẤT XỬ LÝ DỮ LIỆU CHO NGÀY: {processed_date.strftime('%Y-%m-%d')}.")
+                # Hàng đợi PostgreSQL tự giữ trạng thái hoàn thành chung; control_state/page_state SQLite chỉ dùng
+                # cho hàng đợi cục bộ
+                if settings.WORK_QUEUE_BACKEND != "postgres":
+                    clear_page_state_for_day(STATE_DB_PATH, processed_date)
+                    work_queue.advance_completed_watermark()
+        elif scrape_status == "preempted":
+            work_queue.release(unit)
+            logging.info(
+                f"⏸️ {unit.label()} đã dừng theo yêu cầu sau trang {result_data.get('last_processed_page')}. "
+                f"Sẽ tiếp tục từ checkpoint.")
+        elif scrape_status == "worker_crash":
+            work_queue.fail(unit)
+            message = result_data.get("message", "Không rõ.")
+            traceback_str = result_data.get("traceback", "Không có traceback.")
+            logging.error(
+                f"💀 Worker cho {unit.label()} bị CRASH. Lý do: {message}")
+            error_title = f"Worker CRASHed on day {processed_date.strftime('%Y-%m-%d')}"
+            error_message = TelegramNotifier.format_error_message(error_title, traceback_str)
+            TelegramNotifier.send_message(error_message, use_proxy=True, is_error=True)
+        else:
+            work_queue.fail(unit)
+            logging.warning(
+                f"{unit.label()} chưa hoàn thành. Trạng thái đã được lưu.")
+    except Exception as e:
+        work_queue.fail(unit)
+        logging.error(f"Lỗi khi lấy kết quả từ future cho {unit.label()}: {e}",
+                      exc_info=True)
+        error_title = f"Lỗi MANAGER khi xử lý kết quả ngày {processed_date}"
+        TelegramNotifier.send_message(TelegramNotifier.format_error_message(error_title, e),
+                                      use_proxy=True, is_error=True)
+
+
+def queue_in_progress_days(work_queue) -> None:
+    # Ngày dở dang chỉ có page_state (chưa có đơn vị việc) được đưa vào hàng đợi dưới dạng cả ngày
+    work_queue.requeue_unfinished()
+    work_queue.put_many([WorkUnit(day) for day in get_all_in_progress_days(STATE_DB_PATH)
+                         if not work_queue.has_day(day)])
+
+
+def next_unqueued_day(work_queue) -> date_type:
+    next_day = get_next_sequential_day_to_process()
+    while work_queue.has_day(next_day):
+        next_day += timedelta(days=1)
+    return next_day
+
+
+async def close_shared_context(context: dict) -> None:
+    try:
+        await context["scraper"].close()
+    finally:
+        context["engine"].dispose()
+
+
 async def daily_scraping_manager():
-    logging.info("Khởi tạo Scraping Manager với Multiprocessing.")
+    # EXECUTION_MODE=process: mỗi đơn vị việc chạy trong một worker process (ProcessPoolExecutor).
+    # EXECUTION_MODE=asyncio: mọi đơn vị việc là coroutine trong process này, dùng chung HTTP client, DB pool và rate limiter.
+    async_mode = settings.EXECUTION_MODE == "asyncio"
+    max_active_tasks = settings.ASYNC_CONCURRENT_TASKS if async_mode else NUM_PROCESSES
+    logging.info(f"Khởi tạo Scraping Manager với {'asyncio' if async_mode else 'Multiprocessing'} "
+                 f"({max_active_tasks} task song song).")
+    precreate_partitions(
+        date_type(settings.INITIAL_SCRAPE_START_YEAR, settings.INITIAL_SCRAPE_START_MOTH, settings.INITIAL_SCRAPE_START_DAY),
+        get_overall_end_date())
+
+    async with AsyncExitStack() as exit_stack:
+        loop = asyncio.get_running_loop()
+        # stop_event: worker kiểm tra giữa các trang (hết phiên làm việc hoặc SIGTERM).
+        # shutdown_event: SIGTERM/SIGINT -> dừng hẳn manager sau khi các worker đã checkpoint
+        stop_event = multiprocessing.get_context().Event()
+        shutdown_event = asyncio.Event()
+
+        def request_shutdown():
+            logging.warning("Nhận tín hiệu dừng. Yêu cầu các worker dừng sau trang hiện tại...")
+            stop_event.set()
+            shutdown_event.set()
+
+        for shutdown_signal in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(shutdown_signal, request_shutdown)
+        exit_stack.callback(loop.remove_signal_handler, signal.SIGINT)
+        exit_stack.callback(loop.remove_signal_handler, signal.SIGTERM)
+
+        if async_mode:
+            parse_executor = None
+            if settings.HTML_PARSE_PROCESSES > 0:
+                parse_executor = exit_stack.enter_context(ProcessPoolExecutor(max_workers=settings.HTML_PARSE_PROCESSES))
+            shared_context = build_worker_context(settings.DATABASE_URL, MEDIA_PHYSICAL_DIR, db_pool_size=max_active_tasks,
+                                                  loop=loop, parse_executor=parse_executor, offload_db_calls=True,
+                                                  stop_event=stop_event)
+            exit_stack.push_async_callback(close_shared_context, shared_context)
+
+            def submit_unit(unit: WorkUnit):
+                return asyncio.ensure_future(process_unit(unit, shared_context, queue_owner=queue_owner))
+        else:
+            executor = exit_stack.enter_context(ProcessPoolExecutor(
+                max_workers=NUM_PROCESSES, initializer=init_scrape_worker,
+                initargs=(settings.DATABASE_URL, MEDIA_PHYSICAL_DIR, False, stop_event)))
+
+            def submit_unit(unit: WorkUnit):
+                return asyncio.wrap_future(
+                    executor.submit(scrape_unit_worker, unit, settings.DATABASE_URL, MEDIA_PHYSICAL_DIR,
+                                    queue_owner=queue_owner), loop=loop)
 
-    with ProcessPoolExecutor(max_workers=NUM_PROCESSES) as executor:
         overall_end_date = get_overall_end_date()
+        # asyncio future (task hoặc future của executor) -> đơn vị việc (ngày hoặc khoảng trang của ngày)
         active_futures = {}
 
-
-        priority_task_queue = deque(get_all_in_progress_days(STATE_DB_PATH))
-        next_day_to_process = get_next_sequential_day_to_process()
-        processed_or_queued = set(priority_task_queue)
-        while next_day_to_process in processed_or_queued:
-            next_day_to_process += timedelta(days=1)
+        # Hàng đợi ưu tiên: các đơn vị dở dang/đã chia trong state database, rồi mới tới ngày tuần tự tiếp theo
+        distributed_queue = settings.WORK_QUEUE_BACKEND == "postgres"
+        if distributed_queue:
+            # Mọi máy gieo cùng một kế hoạch (ON CONFLICT DO NOTHING) rồi cùng claim từ hàng đợi chung
+            queue_engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, pool_size=1, max_overflow=1)
+            exit_stack.callback(queue_engine.dispose)
+            work_queue = PostgresWorkQueue(queue_engine, lease_seconds=settings.WORK_QUEUE_LEASE_SECONDS)
+            work_queue.ensure_schema()
+            plan_start = date_type(settings.INITIAL_SCRAPE_START_YEAR, settings.INITIAL_SCRAPE_START_MOTH,
+                                   settings.INITIAL_SCRAPE_START_DAY)
+            work_queue.put_many([WorkUnit(plan_start + timedelta(days=offset))
+                                 for offset in range((overall_end_date - plan_start).days + 1)])
+            work_queue.requeue_unfinished()
+            next_day_to_process = overall_end_date + timedelta(days=1)
+            # Worker ghi checkpoint chung dưới lease của manager này
+            queue_owner = work_queue.owner
+            logging.info(f"Dùng hàng đợi chung PostgreSQL (owner: {work_queue.owner}).")
+        else:
+            work_queue = LocalWorkQueue(STATE_DB_PATH)
+            queue_owner = None
+            queue_in_progress_days(work_queue)
+            next_day_to_process = next_unqueued_day(work_queue)
 
         while True:
-            if not active_futures and not priority_task_queue and next_day_to_process > overall_end_date:
-                logging.info("Đã xử lý hết tất cả các ngày theo kế hoạch. Kết thúc chương trình.")
+            if not active_futures and not work_queue.has_pending() and next_day_to_process > overall_end_date:
+                logging.info("Đã xử lý hết tất cả các ngày theo kế hoạch.")
                 break
 
             logging.info(
                 f"====== BẮT ĐẦU PHIÊN LÀM VIỆC MỚI ({settings.RUN_DURATION_MINUTES} PHÚT) lúc {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======")
-            session_start_time_ns = asyncio.get_event_loop().time()
-
-
-            while (asyncio.get_event_loop().time() - session_start_time_ns) < RUN_DURATION_SECONDS:
-
-
-                if active_futures:
-                    for future in as_completed(list(active_futures.keys())):
-                        processed_date = active_futures.pop(future)
-                        try:
-                            worker_output = future.result()
-                            result_data = worker_output.get("result", {})
-                            scrape_status = result_data.get("status", "unknown_error")
-
-                            logging.info(
-                                f"Worker cho ngày {processed_date.strftime('%Y-%m-%d')} đã HOÀN THÀNH. Status: {scrape_status}")
-
-                            if scrape_status in ["completed_all_pages", "no_data_on_first_page"]:
-                                logging.info(
-                                    f"✅ HOÀN TẤT XỬ LÝ DỮ LIỆU CHO NGÀY: {processed_date.strftime('%Y-%m-%d')}.")
-                                save_control_state(STATE_DB_PATH, processed_date)
-                                clear_page_state_for_day(STATE_DB_PATH, processed_date)
-                            elif scrape_status == "worker_crash":
-                                message = result_data.get("message", "Không rõ.")
-                                traceback_str = result_data.get("traceback", "Không có traceback.")
-                                logging.error(
-                                    f"💀 Worker cho ngày {processed_date.strftime('%Y-%m-%d')} bị CRASH. Lý do: {message}")
-                                error_title = f"Worker CRASHed on day {processed_date.strftime('%Y-%m-%d')}"
-                                error_message = TelegramNotifier.format_error_message(error_title, traceback_str)
-                                TelegramNotifier.send_message(error_message, use_proxy=True, is_error=True)
-                            else:
-                                logging.warning(
-                                    f"Ngày {processed_date.strftime('%Y-%m-%d')} chưa hoàn thành. Trạng thái đã được lưu.")
-                        except Exception as e:
-                            logging.error(f"Lỗi khi lấy kết quả từ future cho ngày {processed_date}: {e}",
-                                          exc_info=True)
-                            error_title = f"Lỗi MANAGER khi xử lý kết quả ngày {processed_date}"
-                            TelegramNotifier.send_message(TelegramNotifier.format_error_message(error_title, e),
-                                                          use_proxy=True, is_error=True)
-
-
-                while len(active_futures) < NUM_PROCESSES:
-                    day_for_worker = None
-                    if priority_task_queue:
-                        day_for_worker = priority_task_queue.popleft()
-                    elif next_day_to_process <= overall_end_date:
-                        day_for_worker = next_day_to_process
+            session_start_time_ns = loop.time()
+
+
+            while (loop.time() - session_start_time_ns) < RUN_DURATION_SECONDS and not shutdown_event.is_set():
+
+
+                while len(active_futures) < max_active_tasks:
+                    unit_for_worker = work_queue.claim()
+                    if unit_for_worker is None and next_day_to_process <= overall_end_date:
+                        work_queue.put_many([WorkUnit(next_day_to_process)])
                         next_day_to_process += timedelta(days=1)
-                    else:
+                        unit_for_worker = work_queue.claim()
+                    if unit_for_worker is None:
                         break
 
-                    if day_for_worker:
-                        logging.info(f"--- Chuẩn bị gửi task cho ngày: {day_for_worker.strftime('%Y-%m-%d')} ---")
-                        future = executor.submit(scrape_day_worker, day_for_worker, settings.DATABASE_URL,
-                                                 MEDIA_PHYSICAL_DIR)
-                        active_futures[future] = day_for_worker
-                    else:
-                        break
+                    logging.info(f"--- Chuẩn bị gửi task cho: {unit_for_worker.label()} ---")
+                    active_futures[submit_unit(unit_for_worker)] = unit_for_worker
 
 
                 if not active_futures:
                     break
 
-                await asyncio.sleep(1)
+                # Chờ worker đầu tiên xong (không chặn event loop) rồi quay lại lấp ngay slot trống
+                remaining_seconds = RUN_DURATION_SECONDS - (loop.time() - session_start_time_ns)
+                if distributed_queue:
+                    # Thức dậy đủ thường xuyên để gia hạn lease của các đơn vị đang chạy
+                    remaining_seconds = min(remaining_seconds, settings.WORK_QUEUE_LEASE_SECONDS / 3)
+                if len(active_futures) < max_active_tasks:
+                    # Còn slot trống: worker đang chạy có thể vừa chia trang của ngày lớn vào hàng đợi
+                    remaining_seconds = min(remaining_seconds, IDLE_SLOT_POLL_SECONDS)
+                shutdown_waiter = asyncio.ensure_future(shutdown_event.wait())
+                done_futures, _ = await asyncio.wait(list(active_futures.keys()) + [shutdown_waiter],
+                                                     timeout=max(remaining_seconds, 0),
+                                                     return_when=asyncio.FIRST_COMPLETED)
+                shutdown_waiter.cancel()
+                work_queue.renew([unit for future, unit in active_futures.items() if future not in done_futures])
+                for future in done_futures:
+                    if future is not shutdown_waiter:
+                        handle_worker_result(active_futures.pop(future), future, work_queue)
 
             logging.info(f"====== KẾT THÚC PHIÊN LÀM VIỆC lúc {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======")
 
 
             if active_futures:
-                logging.info(f"Hết giờ làm việc, chờ {len(active_futures)} tasks đang chạy hoàn thành...")
-                for future in as_completed(list(active_futures.keys())):
-                    active_futures.pop(future)
-                logging.info("Tất cả các task trong phiên đã hoàn thành.")
+                # Worker commit + checkpoint trang đang làm rồi trả về "preempted", không chờ hết cả ngày
+                logging.info(f"Hết giờ làm việc, yêu cầu {len(active_futures)} tasks dừng sau trang hiện tại...")
+                stop_event.set()
+                done_futures, _ = await asyncio.wait(list(active_futures.keys()))
+                for future in done_futures:
+                    handle_worker_result(active_futures.pop(future), future, work_queue)
+                logging.info("Tất cả các task trong phiên đã dừng.")
+            if shutdown_event.is_set():
+                logging.info("Manager dừng theo tín hiệu. Các đơn vị việc dở dang sẽ tiếp tục ở lần chạy sau.")
+                break
+            stop_event.clear()
 
 
-            if not priority_task_queue and next_day_to_process > overall_end_date:
+            if not work_queue.has_pending() and next_day_to_process > overall_end_date:
                 continue
 
 
             logging.info(f"====== BẮT ĐẦU NGHỈ NGƠI ({settings.PAUSE_DURATION_MINUTES} PHÚT) ======")
-            await asyncio.sleep(PAUSE_DURATION_SECONDS)
+            try:
+                await asyncio.wait_for(shutdown_event.wait(), timeout=PAUSE_DURATION_SECONDS)
+                logging.info("Manager dừng theo tín hiệu trong lúc nghỉ.")
+                break
+            except asyncio.TimeoutError:
+                pass
             logging.info("====== KẾT THÚC NGHỈ NGƠI ======")
 
 
-            current_queued_days = set(priority_task_queue)
-            priority_task_queue.extend(
-                [d for d in get_all_in_progress_days(STATE_DB_PATH) if d not in current_queued_days])
-            next_day_to_process = get_next_sequential_day_to_process()
-            while next_day_to_process in set(priority_task_queue):
-                next_day_to_process += timedelta(days=1)
+            if distributed_queue:
+                work_queue.requeue_unfinished()
+            else:
+                queue_in_progress_days(work_queue)
+                next_day_to_process = max(next_day_to_process, next_unqueued_day(work_queue))
+
+        # True nếu đã chạy hết kế hoạch, False nếu dừng theo tín hiệu
+        return not shutdown_event.is_set()
 
 
 try:
@@ -278,14 +541,148 @@ except Exception as e_db_setup:
     exit(1)
 
 
-async def main_async_runner():
-    await daily_scraping_manager()
+def run_offline_reprocess(start_day: date_type, end_day: date_type):
+    """Bóc tách và nạp lại DB từ HTML đã lưu trong archive, không gửi request nào."""
+    archived_days = HtmlArchive(HTML_ARCHIVE_DIR).list_archived_days(start_day, end_day)
+    logging.info(
+        f"[Offline] Tìm thấy {len(archived_days)} ngày trong archive từ {start_day.strftime('%Y-%m-%d')} "
+        f"đến {end_day.strftime('%Y-%m-%d')}.")
+    if not archived_days:
+        return
+    precreate_partitions(archived_days[0], archived_days[-1])
+
+    with ProcessPoolExecutor(max_workers=NUM_PROCESSES, initializer=init_scrape_worker,
+                             initargs=(settings.DATABASE_URL, MEDIA_PHYSICAL_DIR, True)) as executor:
+        futures = {
+            executor.submit(scrape_day_worker, day, settings.DATABASE_URL, MEDIA_PHYSICAL_DIR, True): day
+            for day in archived_days
+        }
+        failed_days = []
+        incomplete_days = []
+        for future in as_completed(futures):
+            processed_date = futures[future]
+            # Một ngày lỗi (gzip hỏng, lỗi DB, worker chết...) không được làm dừng cả lần chạy lại nhiều năm
+            try:
+                result_data = future.result().get("result", {})
+            except Exception as e:
+                failed_days.append(processed_date)
+                logging.error(f"[Offline] Lỗi khi xử lý ngày {processed_date.strftime('%Y-%m-%d')}: {e}", exc_info=True)
+                error_title = f"[Offline] Lỗi khi chạy lại ngày {processed_date.strftime('%Y-%m-%d')}"
+                TelegramNotifier.send_message(TelegramNotifier.format_error_message(error_title, e),
+                                              use_proxy=True, is_error=True)
+                continue
+            if result_data.get("status") == "worker_crash":
+                failed_days.append(processed_date)
+                logging.error(
+                    f"[Offline] Ngày {processed_date.strftime('%Y-%m-%d')} bị CRASH: {result_data.get('message')}")
+                continue
+            if result_data.get("status") == "archive_incomplete":
+                incomplete_days.append(processed_date)
+            logging.info(
+                f"[Offline] Ngày {processed_date.strftime('%Y-%m-%d')}: {result_data.get('status')} - "
+                f"{result_data.get('brands_processed_count', 0)} nhãn hiệu mới.")
+        if failed_days:
+            logging.warning(
+                f"[Offline] {len(failed_days)} ngày lỗi, chạy lại riêng các ngày này: "
+                f"{[day.strftime('%Y-%m-%d') for day in sorted(failed_days)]}")
+        if incomplete_days:
+            logging.warning(
+                f"[Offline] {len(incomplete_days)} ngày thiếu trang trong archive, cần cào lại online: "
+                f"{[day.strftime('%Y-%m-%d') for day in sorted(incomplete_days)]}")
+
+
+def get_tail_window() -> tuple:
+    tail_end = datetime.now().date() - timedelta(days=1)
+    return tail_end - timedelta(days=max(settings.TAIL_WINDOW_DAYS, 1) - 1), tail_end
+
+
+async def tail_scraping_manager():
+    """Quét lại định kỳ TAIL_WINDOW_DAYS ngày gần nhất, mỗi ngày dừng ở trang đầu tiên chỉ gồm số đơn đã biết."""
+    loop = asyncio.get_running_loop()
+    stop_event = multiprocessing.get_context().Event()
+    shutdown_event = asyncio.Event()
+
+    def request_shutdown():
+        logging.warning("[Tail] Nhận tín hiệu dừng. Yêu cầu các worker dừng sau trang hiện tại...")
+        stop_event.set()
+        shutdown_event.set()
+
+    for shutdown_signal in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(shutdown_signal, request_shutdown)
+    try:
+        with ProcessPoolExecutor(max_workers=NUM_PROCESSES, initializer=init_scrape_worker,
+                                 initargs=(settings.DATABASE_URL, MEDIA_PHYSICAL_DIR, False, stop_event)) as executor:
+            while not shutdown_event.is_set():
+                tail_start, tail_end = get_tail_window()
+                logging.info(
+                    f"====== [Tail] QUÉT LẠI {tail_start.strftime('%Y-%m-%d')} - {tail_end.strftime('%Y-%m-%d')} ======")
+                precreate_partitions(tail_start, tail_end)
+                futures = {
+                    asyncio.wrap_future(executor.submit(scrape_day_worker, tail_start + timedelta(days=offset),
+                                                        settings.DATABASE_URL, MEDIA_PHYSICAL_DIR, False, True),
+                                        loop=loop): tail_start + timedelta(days=offset)
+                    for offset in range((tail_end - tail_start).days + 1)
+                }
+                done_futures, _ = await asyncio.wait(list(futures.keys()))
+                for future in done_futures:
+                    processed_date = futures[future]
+                    try:
+                        result_data = future.result().get("result", {})
+                    except Exception as e:
+                        logging.error(f"[Tail] Lỗi khi lấy kết quả ngày {processed_date}: {e}", exc_info=True)
+                        continue
+                    logging.info(
+                        f"[Tail] Ngày {processed_date.strftime('%Y-%m-%d')}: {result_data.get('status')} - "
+                        f"{result_data.get('brands_processed_count', 0)} nhãn hiệu mới, "
+                        f"dừng sau trang {result_data.get('last_processed_page')}.")
+
+                logging.info(f"====== [Tail] NGHỈ {settings.TAIL_INTERVAL_MINUTES} PHÚT ======")
+                try:
+                    await asyncio.wait_for(shutdown_event.wait(), timeout=settings.TAIL_INTERVAL_MINUTES * 60)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        loop.remove_signal_handler(signal.SIGTERM)
+    logging.info("[Tail] Đã dừng.")
+
+
+def parse_cli_args():
+    parser = argparse.ArgumentParser(description="Cào dữ liệu nhãn hiệu từ vietnamtrademark.net")
+    parser.add_argument("--offline", action="store_true",
+                        help="Chạy lại bóc tách + nạp DB từ html_archive, không truy cập mạng.")
+    parser.add_argument("--from", dest="from_day", help="Ngày bắt đầu (YYYY-MM-DD) cho chế độ offline.")
+    parser.add_argument("--to", dest="to_day", help="Ngày kết thúc (YYYY-MM-DD) cho chế độ offline.")
+    parser.add_argument("--tail", action="store_true",
+                        help="Chỉ chạy chế độ tail: quét lại định kỳ các ngày gần đây, dừng ở trang toàn số đơn đã biết.")
+    return parser.parse_args()
+
+
+async def main_async_runner(tail_only: bool = False):
+    if not tail_only:
+        finished_plan = await daily_scraping_manager()
+        if not (finished_plan and settings.TAIL_AFTER_BACKFILL):
+            return
+    await tail_scraping_manager()
 
 
 if __name__ == "__main__":
+    cli_args = parse_cli_args()
+    # Số liệu Prometheus được cộng dồn qua các process trong thư mục metrics; bắt đầu lại từ 0 cho mỗi lần chạy
+    reset_metrics_dir()
+    reset_trace_dir()
+    if cli_args.offline:
+        offline_start = datetime.strptime(cli_args.from_day, "%Y-%m-%d").date() if cli_args.from_day else date_type(
+            settings.INITIAL_SCRAPE_START_YEAR, settings.INITIAL_SCRAPE_START_MOTH, settings.INITIAL_SCRAPE_START_DAY)
+        offline_end = datetime.strptime(cli_args.to_day, "%Y-%m-%d").date() if cli_args.to_day else get_overall_end_date()
+        run_offline_reprocess(offline_start, offline_end)
+        if settings.TRACE_ENABLED:
+            export_chrome_trace()
+        exit(0)
+
     try:
         TelegramNotifier.send_message("✅ <b>Tool Scraper đã bắt đầu chạy.</b>", use_proxy=True)
-        asyncio.run(main_async_runner())
+        asyncio.run(main_async_runner(tail_only=cli_args.tail))
     except KeyboardInterrupt:
         TelegramNotifier.send_message("🟡 <b>Tool bị dừng bởi người dùng (Ctrl+C).</b>", use_proxy=True)
     except Exception as e:
@@ -293,4 +690,6 @@ if __name__ == "__main__":
         error_message = TelegramNotifier.format_error_message(error_title, e)
         TelegramNotifier.send_message(error_message, use_proxy=True, is_error=True)
     finally:
+        if settings.TRACE_ENABLED:
+            export_chrome_trace()
         TelegramNotifier.send_message("ℹ️ <b>Chương trình đã kết thúc.</b>", use_proxy=True)
@@ -36,16 +36,53 @@ class Settings(BaseSettings):
     DOWNLOAD_TIMEOUT: float = float(os.getenv("DOWNLOAD_TIMEOUT"))
     REQUEST_LIMIT_PER_INTERVAL: int = int(os.getenv("REQUEST_LIMIT", os.getenv("REQUEST_LIMIT_PER_INTERVAL")))
     REQUEST_INTERVAL_SECONDS: int = int(os.getenv("REQUEST_INTERVAL_SECONDS"))
+    RATE_LIMITER_ENABLED: bool = os.getenv("RATE_LIMITER_ENABLED", "true").lower() == 'true'
+    PER_PROXY_REQUEST_LIMIT_PER_INTERVAL: int = int(os.getenv("PER_PROXY_REQUEST_LIMIT_PER_INTERVAL", "0"))
+    PROXY_EWMA_ALPHA: float = float(os.getenv("PROXY_EWMA_ALPHA", "0.3"))
+    PROXY_FAILURE_THRESHOLD: int = int(os.getenv("PROXY_FAILURE_THRESHOLD", "3"))
+    PROXY_COOLDOWN_SECONDS: float = float(os.getenv("PROXY_COOLDOWN_SECONDS", "60"))
+    PROXY_MAX_COOLDOWN_SECONDS: float = float(os.getenv("PROXY_MAX_COOLDOWN_SECONDS", "900"))
     MIN_REQUEST_DELAY: float = float(os.getenv("REQUEST_DELAY", os.getenv("MIN_REQUEST_DELAY")))
     MAX_REQUEST_DELAY: float = float(os.getenv("MAX_REQUEST_DELAY"))
     MIN_DELAY_CHECK_PENDING: float = float(os.getenv("MIN_DELAY_CHECK_PENDING"))
     MAX_DELAY_CHECK_PENDING: float = float(os.getenv("MAX_DELAY_CHECK_PENDING"))
     MEDIA_BRAND_IMAGES_SUBPATH : Optional[str] = os.getenv("MEDIA_BRAND_IMAGES_SUBPATH")
+    HTTP_MAX_CONNECTIONS_PER_PROXY: int = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_PROXY", "10"))
+    HTTP_MAX_KEEPALIVE_PER_PROXY: int = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_PROXY", "5"))
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    IMAGE_DOWNLOAD_CONCURRENCY: int = int(os.getenv("IMAGE_DOWNLOAD_CONCURRENCY", "8"))
+    IMAGE_STREAM_CHUNK_SIZE: int = int(os.getenv("IMAGE_STREAM_CHUNK_SIZE", "65536"))
+    IMAGE_MAX_BYTES: int = int(os.getenv("IMAGE_MAX_BYTES", "0"))
+    HTML_ARCHIVE_ENABLED: bool = os.getenv("HTML_ARCHIVE_ENABLED", "false").lower() == 'true'
+    HTML_PARSER_BACKEND: str = os.getenv("HTML_PARSER_BACKEND", "html.parser")
+    HTML_PARSE_IN_THREAD: bool = os.getenv("HTML_PARSE_IN_THREAD", "false").lower() == 'true'
+    BRAND_BULK_LOAD_MODE: str = os.getenv("BRAND_BULK_LOAD_MODE", "copy").lower()
+    PAGES_PER_COMMIT: int = int(os.getenv("PAGES_PER_COMMIT", "1"))
+    KNOWN_APPLICATION_INDEX_ENABLED: bool = os.getenv("KNOWN_APPLICATION_INDEX_ENABLED", "true").lower() == 'true'
+    PAGES_PER_WORK_UNIT: int = int(os.getenv("PAGES_PER_WORK_UNIT", "20"))
 ##
     RUN_DURATION_MINUTES: int = int(os.getenv("RUN_DURATION_MINUTES"))
     PAUSE_DURATION_MINUTES: int = int(os.getenv("PAUSE_DURATION_MINUTES"))
 
     CONCURRENT_SCRAPING_TASKS: int = int(os.getenv("CONCURRENT_SCRAPING_TASKS"))
+    WORKER_DB_POOL_SIZE: int = int(os.getenv("WORKER_DB_POOL_SIZE", "2"))
+    EXECUTION_MODE: str = os.getenv("EXECUTION_MODE", "process").lower()
+    ASYNC_CONCURRENT_TASKS: int = int(os.getenv("ASYNC_CONCURRENT_TASKS", "16"))
+    HTML_PARSE_PROCESSES: int = int(os.getenv("HTML_PARSE_PROCESSES", "0"))
+    STOP_GRACE_SECONDS: float = float(os.getenv("STOP_GRACE_SECONDS", "120"))
+    WORK_QUEUE_BACKEND: str = os.getenv("WORK_QUEUE_BACKEND", "local").lower()
+    WORK_QUEUE_LEASE_SECONDS: float = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "900"))
+    TAIL_AFTER_BACKFILL: bool = os.getenv("TAIL_AFTER_BACKFILL", "false").lower() == 'true'
+    TAIL_WINDOW_DAYS: int = int(os.getenv("TAIL_WINDOW_DAYS", "7"))
+    TAIL_INTERVAL_MINUTES: float = float(os.getenv("TAIL_INTERVAL_MINUTES", "60"))
+    STATE_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("STATE_FLUSH_INTERVAL_SECONDS", "5"))
+    STATE_FLUSH_MAX_PENDING_PAGES: int = int(os.getenv("STATE_FLUSH_MAX_PENDING_PAGES", "20"))
+    PAGE_METRICS_ENABLED: bool = os.getenv("PAGE_METRICS_ENABLED", "true").lower() == 'true'
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == 'true'
+    PROMETHEUS_MULTIPROC_DIR: Optional[str] = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    TRACE_ENABLED: bool = os.getenv("TRACE_ENABLED", "false").lower() == 'true'
+    TRACE_DIR: Optional[str] = os.getenv("TRACE_DIR")
+    TRACE_FLUSH_EVENTS: int = int(os.getenv("TRACE_FLUSH_EVENTS", "1000"))
 
     PROXY_LOGIN_BOT : str = os.getenv("PROXY_LOGIN")
     PROXY_PASSWORD_BOT: str = os.getenv("PROXY_PASSWORD")
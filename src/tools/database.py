@@ -1,12 +1,15 @@
+import io
 import os
 import sys
 import logging
-from typing import Generator
+from typing import AsyncGenerator, Awaitable, Callable, Generator, Iterable, Set, Dict, List
 from src.tools.config import settings
-from contextlib import contextmanager
-from datetime import datetime, timedelta
-from sqlalchemy import text, Engine, create_engine, inspect
-from sqlmodel import SQLModel, Session, create_engine as create_engine_sqlmodel
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, date as date_type
+from sqlalchemy import text, func, Engine, create_engine, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import SQLModel, Session, select, create_engine as create_engine_sqlmodel
+from src.tools.models import Brand
 #
 logger = logging.getLogger(__name__)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -30,6 +33,20 @@ def get_session(engine_to_use: Engine = db_engine) -> Generator[Session, None, N
     finally:
         session.close()
 
+@asynccontextmanager
+async def get_offloaded_session(run_db: Callable[..., Awaitable], engine_to_use: Engine = db_engine) -> AsyncGenerator[Session, None]:
+    # Như get_session nhưng commit/rollback/close chạy qua run_db (ScraperService.run_db) để không chặn event loop
+    session = Session(engine_to_use)
+    try:
+        yield session
+        await run_db(session.commit)
+    except Exception as e:
+        await run_db(session.rollback)
+        logging.error(f"Database error: {str(e)}")
+        raise
+    finally:
+        await run_db(session.close)
+
 def bulk_create(session: Session, objects: list[SQLModel]) -> None:
     try:
         session.add_all(objects)
@@ -37,6 +54,155 @@ def bulk_create(session: Session, objects: list[SQLModel]) -> None:
         logging.error(f"Bulk create error: {str(e)}")
         raise
 
+def find_existing_application_numbers(session: Session, application_numbers: Iterable[str],
+                                      start_date: date_type, end_date: date_type) -> Set[str]:
+    # Một truy vấn cho cả trang, giới hạn theo ngày nộp đơn để Postgres chỉ quét partition của ngày đó
+    application_numbers = list(set(application_numbers))
+    if not application_numbers:
+        return set()
+    statement = select(Brand.application_number).where(
+        Brand.application_date >= start_date,
+        Brand.application_date <= end_date,
+        Brand.application_number.in_(application_numbers)
+    )
+    return set(session.exec(statement).all())
+
+def load_application_numbers(session: Session, start_date: date_type, end_date: date_type) -> Set[str]:
+    # Toàn bộ số đơn trong khoảng ngày (chỉ chạm partition của khoảng đó), dùng để nạp KnownApplicationIndex
+    statement = select(Brand.application_number).where(
+        Brand.application_date >= start_date,
+        Brand.application_date <= end_date
+    )
+    return set(session.exec(statement).all())
+
+def bulk_insert_ignore(session: Session, brands: list[Brand]) -> int:
+    # INSERT ... ON CONFLICT DO NOTHING nhiều dòng trong một câu lệnh; trả về số dòng thực sự được thêm
+    if not brands:
+        return 0
+    rows = [brand.model_dump(exclude={"id"}) for brand in brands]
+    brand_table = Brand.__table__
+    statement = pg_insert(brand_table).values(rows).on_conflict_do_nothing().returning(brand_table.c.application_number)
+    try:
+        inserted = session.execute(statement).all()
+    except Exception as e:
+        logging.error(f"Bulk insert ignore error: {str(e)}")
+        raise
+    return len(inserted)
+
+# Cột được ghi đè khi nạp lại từ archive; va_count và created_at giữ nguyên giá trị trong DB
+BRAND_UPSERT_COLUMNS = [
+    "brand_name", "image_url", "product_group", "status", "applicant", "representative", "product_detail",
+]
+
+def bulk_upsert_brands(session: Session, brands: list[Brand]) -> int:
+    # INSERT ... ON CONFLICT (application_number, application_date) DO UPDATE: bản ghi đã có được cập nhật theo
+    # kết quả bóc tách mới (dùng khi chạy lại từ html_archive); trả về số dòng được thêm hoặc cập nhật
+    if not brands:
+        return 0
+    rows = [brand.model_dump(exclude={"id"}) for brand in brands]
+    brand_table = Brand.__table__
+    statement = pg_insert(brand_table).values(rows)
+    update_values = {column: statement.excluded[column] for column in BRAND_UPSERT_COLUMNS}
+    # Chạy offline không tải ảnh mới: không xóa image_url đã có khi lần này không có ảnh
+    update_values["image_url"] = func.coalesce(func.nullif(statement.excluded.image_url, ""), brand_table.c.image_url)
+    update_values["updated_at"] = statement.excluded.updated_at
+    statement = statement.on_conflict_do_update(
+        index_elements=[brand_table.c.application_number, brand_table.c.application_date],
+        set_=update_values
+    ).returning(brand_table.c.application_number)
+    try:
+        upserted = session.execute(statement).all()
+    except Exception as e:
+        logging.error(f"Bulk upsert error: {str(e)}")
+        raise
+    return len(upserted)
+
+BRAND_COPY_COLUMNS = [
+    "brand_name", "image_url", "product_group", "status", "application_date", "application_number",
+    "applicant", "representative", "product_detail", "va_count", "created_at", "updated_at",
+]
+
+create_copy_stage_sql = """
+CREATE TEMP TABLE IF NOT EXISTS brand_copy_stage (
+    brand_name text,
+    image_url text,
+    product_group text,
+    status text,
+    application_date date,
+    application_number text,
+    applicant text,
+    representative text,
+    product_detail text,
+    va_count integer,
+    created_at timestamp without time zone,
+    updated_at timestamp without time zone
+) ON COMMIT DELETE ROWS;
+"""
+
+def _copy_text_value(value) -> str:
+    # Định dạng TEXT của COPY: NULL là \N, escape \, tab và xuống dòng
+    if value is None:
+        return "\\N"
+    if isinstance(value, (datetime, date_type)):
+        return value.isoformat()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def copy_insert_brands(session: Session, brands: list[Brand]) -> int:
+    # COPY vào bảng tạm rồi INSERT ... SELECT thẳng vào partition brand_YYYY_MM (bỏ qua bước định tuyến của bảng cha)
+    brands_by_partition: Dict[str, List[Brand]] = {}
+    for brand in brands:
+        brands_by_partition.setdefault(get_partition_name(brand.application_date), []).append(brand)
+
+    raw_cursor = session.connection().connection.cursor()
+    column_list = ", ".join(BRAND_COPY_COLUMNS)
+    inserted_total = 0
+    try:
+        raw_cursor.execute(create_copy_stage_sql)
+        for partition_name, partition_brands in brands_by_partition.items():
+            buffer = io.StringIO()
+            for brand in partition_brands:
+                brand_values = brand.model_dump(include=set(BRAND_COPY_COLUMNS))
+                buffer.write("\t".join(_copy_text_value(brand_values[column]) for column in BRAND_COPY_COLUMNS) + "\n")
+            buffer.seek(0)
+            raw_cursor.execute("TRUNCATE brand_copy_stage;")
+            raw_cursor.copy_expert(f"COPY brand_copy_stage ({column_list}) FROM STDIN WITH (FORMAT text)", buffer)
+            raw_cursor.execute(f"""
+                INSERT INTO "{partition_name}" (id, {column_list})
+                SELECT nextval('public.brand_id_seq'), {column_list} FROM brand_copy_stage
+                ON CONFLICT DO NOTHING;
+            """)
+            inserted_total += raw_cursor.rowcount
+    finally:
+        raw_cursor.close()
+    return inserted_total
+
+# Driver có copy_expert hay không chỉ kiểm tra một lần cho mỗi process (tất cả engine dùng cùng DATABASE_URL)
+_copy_driver_supported = None
+
+def copy_driver_supported(session: Session) -> bool:
+    global _copy_driver_supported
+    if _copy_driver_supported is None:
+        driver = session.get_bind().dialect.driver
+        _copy_driver_supported = driver == "psycopg2"
+        if not _copy_driver_supported:
+            logging.warning(
+                f"BRAND_BULK_LOAD_MODE=copy cần driver psycopg2 (copy_expert), driver hiện tại là '{driver}'. "
+                f"Dùng INSERT nhiều dòng.")
+    return _copy_driver_supported
+
+def bulk_load_brands(session: Session, brands: list[Brand]) -> int:
+    # BRAND_BULK_LOAD_MODE=copy dùng COPY, lỗi thì quay về INSERT nhiều dòng trong cùng transaction (nhờ savepoint)
+    if not brands:
+        return 0
+    if settings.BRAND_BULK_LOAD_MODE == "copy" and copy_driver_supported(session):
+        try:
+            with session.begin_nested():
+                return copy_insert_brands(session, brands)
+        except Exception as e:
+            logging.warning(f"COPY bulk load lỗi, chuyển sang INSERT nhiều dòng: {str(e)}")
+    return bulk_insert_ignore(session, brands)
+
 def get_partition_name(date: datetime) -> str:
     return f"brand_{date.strftime('%Y_%m')}"
 
@@ -81,6 +247,100 @@ def ensure_partition_exists(date: datetime,engine_to_use: Engine = db_engine) ->
         logging.error(f"❌ Lỗi khi kiểm tra/tạo partition '{partition_name}': {str(e)}")  
         raise
 
+def iter_partition_months(start_date: date_type, end_date: date_type) -> Generator[datetime, None, None]:
+    month_start = datetime(start_date.year, start_date.month, 1)
+    while month_start.date() <= end_date:
+        yield month_start
+        month_start = (month_start + timedelta(days=32)).replace(day=1)
+
+class PartitionRegistry:
+    # Danh sách partition brand_YYYY_MM đã có, nạp một lần từ pg_inherits; kiểm tra theo ngày chỉ là tra set trong bộ nhớ
+    def __init__(self):
+        self.known_partitions: Set[str] = set()
+        self.loaded = False
+
+    def load(self, engine_to_use: Engine = db_engine) -> Set[str]:
+        query = text("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            JOIN pg_namespace ns ON ns.oid = parent.relnamespace
+            WHERE parent.relname = 'brand' AND ns.nspname = 'public';
+        """)
+        with engine_to_use.connect() as conn:
+            self.known_partitions = set(conn.execute(query).scalars().all())
+        self.loaded = True
+        logging.info(f"📦 Đã nạp {len(self.known_partitions)} partition của bảng brand.")
+        return self.known_partitions
+
+    def ensure(self, date: datetime, engine_to_use: Engine = db_engine) -> None:
+        if not self.loaded:
+            self.load(engine_to_use)
+        partition_name = get_partition_name(date)
+        if partition_name in self.known_partitions:
+            return
+        ensure_partition_exists(date, engine_to_use)
+        self.known_partitions.add(partition_name)
+
+    def ensure_range(self, start_date: date_type, end_date: date_type, engine_to_use: Engine = db_engine) -> List[str]:
+        # Tạo mọi partition còn thiếu của khoảng ngày trong một transaction; advisory lock để hai process không tạo cùng lúc
+        self.load(engine_to_use)
+        missing_months = [month_start for month_start in iter_partition_months(start_date, end_date)
+                          if get_partition_name(month_start) not in self.known_partitions]
+        if not missing_months:
+            return []
+        created_partitions = []
+        with engine_to_use.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('brand_partitions'));"))
+            for month_start in missing_months:
+                partition_name = get_partition_name(month_start)
+                month_end = (month_start + timedelta(days=32)).replace(day=1)
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS "{partition_name}"
+                    PARTITION OF brand
+                    FOR VALUES FROM ('{month_start.strftime('%Y-%m-%d')}')
+                    TO ('{month_end.strftime('%Y-%m-%d')}');
+                """))
+                created_partitions.append(partition_name)
+        self.known_partitions.update(created_partitions)
+        logging.info(
+            f"📦 Đã tạo trước {len(created_partitions)} partition cho khoảng "
+            f"{start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}.")
+        return created_partitions
+
+partition_registry = PartitionRegistry()
+
+count_duplicate_brands_sql = """
+SELECT count(*) FROM (
+    SELECT 1 FROM public.brand
+    WHERE application_number IS NOT NULL
+    GROUP BY application_number, application_date
+    HAVING count(*) > 1
+) duplicated;
+"""
+
+# Giữ bản ghi cập nhật gần nhất (rồi id lớn nhất) của mỗi (application_number, application_date), xóa phần còn lại
+dedupe_brands_sql = """
+DELETE FROM public.brand
+WHERE (id, application_date) IN (
+    SELECT id, application_date FROM (
+        SELECT id, application_date,
+               row_number() OVER (PARTITION BY application_number, application_date
+                                  ORDER BY updated_at DESC NULLS LAST, id DESC) AS duplicate_rank
+        FROM public.brand
+        WHERE application_number IS NOT NULL
+    ) ranked
+    WHERE duplicate_rank > 1
+);
+"""
+
+def dedupe_brands(engine_to_use: Engine = db_engine) -> int:
+    with engine_to_use.begin() as connection:
+        deleted = connection.execute(text(dedupe_brands_sql)).rowcount
+    logger.info(f"✅ Đã xóa {deleted} bản ghi brand trùng (application_number, application_date).")
+    return deleted
+
 def setup_database_schema():
     engine = create_engine(settings.DATABASE_URL)
     db_user_for_owner = settings.DB_USER if settings.DB_USER else settings.DATABASE_URL.split('://')[1].split(':')[0]
@@ -115,6 +375,11 @@ def setup_database_schema():
                          CREATE INDEX IF NOT EXISTS ix_brand_brand_name ON public.brand (brand_name); \
                          """
 
+    # Khóa duy nhất phải chứa cột partition (application_date) trên bảng partitioned
+    create_unique_index_sql = """
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_brand_application_number_date ON public.brand (application_number, application_date);
+    """
+
 
     alter_owner_sql = f"""
     ALTER TABLE IF EXISTS public.brand OWNER TO "{db_user_for_owner}";
@@ -163,9 +428,34 @@ def setup_database_schema():
                 logger.info(f"✅ Đã đặt OWNER cho bảng 'brand'.")
 
             connection.commit()
+
+            try:
+                connection.execute(text(create_unique_index_sql))
+                connection.commit()
+                logger.info("✅ Đã kiểm tra/tạo unique index (application_number, application_date).")
+            except Exception as e_unique:
+                # Không có index này thì ON CONFLICT (application_number, application_date) DO UPDATE của chế độ offline
+                # lỗi ở mọi trang và ON CONFLICT DO NOTHING (INSERT/COPY) không còn chống trùng -> không chạy tiếp
+                connection.rollback()
+                duplicate_groups = connection.execute(text(count_duplicate_brands_sql)).scalar_one()
+                connection.rollback()
+                raise RuntimeError(
+                    f"Không tạo được unique index ux_brand_application_number_date: {e_unique}. "
+                    f"Bảng brand có {duplicate_groups} nhóm (application_number, application_date) bị trùng. "
+                    f"Chạy 'python -m src.tools.database --dedupe-brands' để giữ bản ghi mới nhất của mỗi nhóm, "
+                    f"rồi khởi động lại.") from e_unique
             logger.info("🚀 Thiết lập schema database hoàn tất.")
 
         except Exception as e:
             logger.error(f"❌ Lỗi nghiêm trọng khi thiết lập schema database: {e}", exc_info=True)
             connection.rollback()
-            raise
\ No newline at end of file
+            raise
+
+
+if __name__ == '__main__':
+    # python -m src.tools.database --dedupe-brands: xóa bản ghi trùng để tạo được unique index
+    if "--dedupe-brands" in sys.argv:
+        dedupe_brands()
+        setup_database_schema()
+    else:
+        print("Cách dùng: python -m src.tools.database --dedupe-brands")
@@ -0,0 +1,118 @@
+import os
+import gzip
+import json
+import zlib
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterator, List
+
+logger_archive = logging.getLogger(__name__)
+
+GZIP_MEMBER_MAGIC = b"\x1f\x8b\x08"
+READ_CHUNK_BYTES = 64 * 1024
+
+
+def get_html_archive_dir(project_root: str) -> str:
+    return os.path.join(project_root, "html_archive")
+
+
+class HtmlArchive:
+    # Lưu HTML thô của trang kết quả theo (ngày, trang): mỗi ngày một file .jsonl.gz chỉ ghi nối thêm,
+    # mỗi trang là một gzip member riêng nên file luôn đọc được kể cả khi process bị dừng giữa chừng
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+
+    def day_path(self, day: date) -> str:
+        return os.path.join(self.archive_dir, day.strftime("%Y"), day.strftime("%m"), f"{day.strftime('%Y-%m-%d')}.jsonl.gz")
+
+    def append_page(self, day: date, page: int, url: str, html: str) -> None:
+        path = self.day_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {
+            "day": day.strftime("%Y-%m-%d"),
+            "page": page,
+            "url": url,
+            "fetched_at": datetime.now().isoformat(),
+            "html": html,
+        }
+        payload = gzip.compress((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        # Ghi một lần duy nhất với O_APPEND để các process cùng ghi một ngày không chen vào giữa record
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+
+    def load_day(self, day: date) -> Dict[int, str]:
+        path = self.day_path(day)
+        pages: Dict[int, str] = {}
+        if not os.path.exists(path):
+            return pages
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            logger_archive.error(f"[Archive] Lỗi khi đọc {path}: {e}.")
+            return pages
+        for member_offset, payload in self._iter_members(data, path):
+            try:
+                lines = payload.decode("utf-8").splitlines()
+            except UnicodeDecodeError:
+                logger_archive.warning(f"[Archive] Bỏ qua gzip member lỗi mã hoá tại byte {member_offset} trong {path}.")
+                continue
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                    page = int(record["page"])
+                    html = record["html"]
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    logger_archive.warning(f"[Archive] Bỏ qua record hỏng tại byte {member_offset} trong {path}.")
+                    continue
+                # Trang được cào lại sau sẽ ghi đè bản cũ
+                pages[page] = html
+        return pages
+
+    @staticmethod
+    def _iter_members(data: bytes, path: str) -> Iterator[tuple]:
+        # Giải nén từng gzip member một. Member hỏng (sai CRC, dữ liệu rác) được bỏ qua bằng cách tìm header
+        # gzip tiếp theo, nên một trang hỏng không làm mất các trang ghi sau nó; member cuối bị cắt cụt thì dừng.
+        view = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            chunks = []
+            position = offset
+            try:
+                while not decompressor.eof and position < len(data):
+                    chunk = view[position:position + READ_CHUNK_BYTES]
+                    chunks.append(decompressor.decompress(chunk))
+                    position += len(chunk)
+            except zlib.error as e:
+                next_offset = data.find(GZIP_MEMBER_MAGIC, offset + 1)
+                logger_archive.warning(f"[Archive] Bỏ qua gzip member hỏng tại byte {offset} trong {path}: {e}.")
+                if next_offset == -1:
+                    break
+                offset = next_offset
+                continue
+            if not decompressor.eof:
+                logger_archive.warning(f"[Archive] Gzip member cuối tại byte {offset} trong {path} bị cắt cụt. Bỏ qua.")
+                break
+            yield offset, b"".join(chunks)
+            offset = position - len(decompressor.unused_data)
+
+    def list_archived_days(self, start_date: date, end_date: date) -> List[date]:
+        days = []
+        if not os.path.isdir(self.archive_dir):
+            return days
+        for root, _, files in os.walk(self.archive_dir):
+            for filename in files:
+                if not filename.endswith(".jsonl.gz"):
+                    continue
+                try:
+                    day = datetime.strptime(filename[:-len(".jsonl.gz")], "%Y-%m-%d").date()
+                except ValueError:
+                    continue
+                if start_date <= day <= end_date:
+                    days.append(day)
+        days.sort()
+        return days
@@ -0,0 +1,80 @@
+import httpx
+import logging
+from typing import Dict, List, Optional, Tuple
+from src.tools.config import settings
+
+logger_http = logging.getLogger(__name__)
+
+
+def build_proxy_urls() -> List[str]:
+    if not settings.PROXY_IPS or not settings.PROXY_PORTS:
+        return []
+
+    if not (len(settings.PROXY_IPS) == len(settings.PROXY_PORTS)):
+        logger_http.error("lỗi config proxy: độ dài của proxy không trùng .")
+        return []
+
+    has_auth = settings.PROXY_USERNAME and settings.PROXY_PASSWORD
+    proxy_urls = []
+    for proxy_ip, proxy_port in zip(settings.PROXY_IPS, settings.PROXY_PORTS):
+        if has_auth:
+            proxy_urls.append(f"socks5://{settings.PROXY_USERNAME}:{settings.PROXY_PASSWORD}@{proxy_ip}:{proxy_port}")
+        else:
+            proxy_urls.append(f"socks5://{proxy_ip}:{proxy_port}")
+    return proxy_urls
+
+
+class HttpClientPool:
+    # Giữ một AsyncClient keep-alive cho mỗi proxy để tái sử dụng kết nối TCP/TLS; request trang và tải ảnh
+    # dùng chung client, timeout được truyền theo từng request. verify là cấu hình của client nên chỉ tách client
+    # khi SSL_VERIFY_REQUEST và SSL_VERIFY_DOWNLOAD khác nhau.
+    def __init__(self, headers: Dict[str, str]):
+        self.headers = headers
+        self._clients: Dict[Tuple[Optional[str], bool], httpx.AsyncClient] = {}
+
+    @staticmethod
+    def _verify_for(kind: str) -> bool:
+        if kind == "download":
+            return getattr(settings, 'SSL_VERIFY_DOWNLOAD', True)
+        return settings.SSL_VERIFY_REQUEST
+
+    @staticmethod
+    def timeout_for(kind: str) -> httpx.Timeout:
+        if kind == "download":
+            return httpx.Timeout(getattr(settings, 'DOWNLOAD_TIMEOUT', 30.0))
+        return httpx.Timeout(settings.REQUEST_TIMEOUT)
+
+    def _build_client(self, proxy: Optional[str], verify: bool) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS_PER_PROXY,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_PER_PROXY,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        )
+        logger_http.info(f"Tạo HTTP client mới (verify={verify}) với proxy {proxy or 'None'}")
+        return httpx.AsyncClient(
+            proxy=proxy,
+            verify=verify,
+            timeout=self.timeout_for("page"),
+            limits=limits,
+            headers=self.headers,
+            follow_redirects=True,
+        )
+
+    def get_client(self, proxy: Optional[str], kind: str = "page") -> httpx.AsyncClient:
+        key = (proxy, self._verify_for(kind))
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._build_client(*key)
+            self._clients[key] = client
+        return client
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger_http.warning(f"Lỗi khi đóng HTTP client: {e}")
+        if clients:
+            logger_http.info(f"Đã đóng {len(clients)} HTTP client.")
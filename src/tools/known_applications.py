@@ -0,0 +1,35 @@
+import logging
+from datetime import date
+from typing import Iterable, List, Set
+from sqlmodel import Session
+from src.tools.database import load_application_numbers
+
+logger_known = logging.getLogger(__name__)
+
+
+class KnownApplicationIndex:
+    # Tập số đơn đã có trong DB cho khoảng ngày đang cào: nạp một lần bằng một truy vấn,
+    # cập nhật sau mỗi lần ghi, và được tra trước khi hỏi DB
+    def __init__(self):
+        self._application_numbers: Set[str] = set()
+        self.loaded = False
+
+    def load(self, session: Session, start_date: date, end_date: date) -> int:
+        self._application_numbers = load_application_numbers(session, start_date, end_date)
+        self.loaded = True
+        logger_known.info(
+            f"Nạp {len(self._application_numbers)} số đơn đã có cho {start_date.strftime('%Y-%m-%d')}"
+            f" - {end_date.strftime('%Y-%m-%d')}.")
+        return len(self._application_numbers)
+
+    def __contains__(self, application_number: str) -> bool:
+        return application_number in self._application_numbers
+
+    def __len__(self) -> int:
+        return len(self._application_numbers)
+
+    def add_many(self, application_numbers: Iterable[str]) -> None:
+        self._application_numbers.update(application_numbers)
+
+    def unknown(self, application_numbers: Iterable[str]) -> List[str]:
+        return [number for number in application_numbers if number not in self._application_numbers]
@@ -0,0 +1,107 @@
+import os
+import glob
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Optional
+
+logger_media = logging.getLogger(__name__)
+
+
+def get_media_index_path(project_root: str) -> str:
+    return os.path.join(project_root, "media_index.sqlite3")
+
+
+def sniff_image_extension(head: bytes) -> Optional[str]:
+    # Phần mở rộng theo magic bytes của nội dung, để cùng một ảnh không bị lưu hai lần vì Content-Type khác nhau
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if b"<svg" in head.lower():
+        return ".svg"
+    return None
+
+
+class MediaStore:
+    # Lưu ảnh theo sha256 (media_dir/ab/cd/<sha256>.ext) kèm chỉ mục URL nguồn -> đường dẫn đã lưu
+    def __init__(self, media_dir: str, index_db_path: Optional[str] = None):
+        self.media_dir = media_dir
+        self.subfolder_name = os.path.basename(os.path.normpath(media_dir))
+        self.index_db_path = index_db_path or get_media_index_path(os.path.dirname(os.path.abspath(media_dir)))
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connection_pid: Optional[int] = None
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Mỗi process (worker fork) mở kết nối riêng
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.index_db_path, timeout=30.0, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS image_index (
+                    source_url TEXT PRIMARY KEY,
+                    relative_path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            self._connection.commit()
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def physical_path(self, relative_path: str) -> str:
+        relative_inside_media = relative_path.split("/", 1)[1] if "/" in relative_path else relative_path
+        return os.path.join(self.media_dir, *relative_inside_media.split("/"))
+
+    def lookup(self, source_url: str) -> Optional[str]:
+        try:
+            row = self._get_connection().execute(
+                "SELECT relative_path FROM image_index WHERE source_url = ?", (source_url,)).fetchone()
+        except sqlite3.Error as e:
+            logger_media.error(f"[MediaIndex] Lỗi khi tra cứu {source_url}: {e}")
+            return None
+        if not row:
+            return None
+        if not os.path.exists(self.physical_path(row[0])):
+            logger_media.warning(f"[MediaIndex] Tệp {row[0]} của {source_url} không còn trên đĩa. Sẽ tải lại.")
+            return None
+        return row[0]
+
+    def record(self, source_url: str, relative_path: str, sha256: str, size_bytes: int) -> None:
+        try:
+            conn = self._get_connection()
+            conn.execute('''
+                INSERT OR REPLACE INTO image_index (source_url, relative_path, sha256, size_bytes, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (source_url, relative_path, sha256, size_bytes, datetime.now().isoformat()))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger_media.error(f"[MediaIndex] Lỗi khi ghi chỉ mục cho {source_url}: {e}")
+
+    def store_file(self, tmp_path: str, sha256: str, ext: str) -> str:
+        # Tệp được định danh bởi sha256: nếu nội dung đã có trên đĩa (dù đuôi nào) thì bỏ tệp tạm,
+        # ngược lại đổi tên nguyên tử vào đúng thư mục với đuôi xác định từ nội dung
+        folder = os.path.join(self.media_dir, sha256[:2], sha256[2:4])
+        existing_paths = sorted(glob.glob(os.path.join(folder, f"{sha256}.*")))
+        if existing_paths:
+            final_path = existing_paths[0]
+            os.remove(tmp_path)
+            logger_media.debug(f"Nội dung {sha256} đã tồn tại tại {final_path}. Bỏ tệp trùng.")
+        else:
+            with open(tmp_path, "rb") as f:
+                ext = sniff_image_extension(f.read(512)) or ext
+            final_path = os.path.join(folder, f"{sha256}{ext}")
+            os.makedirs(folder, exist_ok=True)
+            os.replace(tmp_path, final_path)
+        return "/".join([self.subfolder_name, sha256[:2], sha256[2:4], os.path.basename(final_path)])
+
+    def close(self) -> None:
+        if self._connection is not None and self._connection_pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+        self._connection_pid = None
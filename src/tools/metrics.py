@@ -0,0 +1,113 @@
+import os
+import glob
+import logging
+from typing import Any, Dict, Optional, Tuple
+from src.tools.config import settings
+
+logger_metrics = logging.getLogger(__name__)
+
+# prometheus_client chọn chế độ multiprocess khi được import lần đầu, nên thư mục phải được đặt trước khi import.
+# Mọi process (manager, worker, Control API) cùng ghi/đọc thư mục này để số liệu được cộng dồn qua các process.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+METRICS_DIR = settings.PROMETHEUS_MULTIPROC_DIR or os.path.join(PROJECT_ROOT, "prometheus_metrics")
+
+prometheus_client = None
+if settings.METRICS_ENABLED:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", METRICS_DIR)
+    METRICS_DIR = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        import prometheus_client
+        from prometheus_client import multiprocess
+    except ImportError:
+        logger_metrics.warning("METRICS_ENABLED=true nhưng chưa cài gói 'prometheus-client'. Bỏ qua metrics.")
+        prometheus_client = None
+    except OSError as e:
+        logger_metrics.error(f"Không thể tạo thư mục metrics {METRICS_DIR}: {e}. Bỏ qua metrics.")
+        prometheus_client = None
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAST_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _NoopMetric:
+    # Thay cho Counter/Histogram/Gauge khi metrics bị tắt, để chỗ gọi không phải kiểm tra
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, amount: float) -> None:
+        pass
+
+
+def _metric(metric_type: str, name: str, documentation: str, labelnames: Tuple[str, ...] = (), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, metric_type)(name, documentation, labelnames, **kwargs)
+
+
+HTTP_REQUESTS = _metric("Counter", "scraper_http_requests_total",
+                        "Số request HTTP theo loại (page/image), proxy và status", ("kind", "proxy", "status"))
+PAGES_SCRAPED = _metric("Counter", "scraper_pages_total", "Số trang kết quả đã xử lý", ("source",))
+PAGE_FETCH_SECONDS = _metric("Histogram", "scraper_page_fetch_seconds",
+                             "Thời gian lấy một trang kết quả, gồm cả retry", ("source",), buckets=LATENCY_BUCKETS)
+PAGE_PARSE_SECONDS = _metric("Histogram", "scraper_page_parse_seconds", "Thời gian parse HTML một trang",
+                             buckets=FAST_BUCKETS)
+DB_WRITE_SECONDS = _metric("Histogram", "scraper_db_write_seconds",
+                           "Thời gian truy vấn trùng + ghi + commit của một trang", buckets=FAST_BUCKETS)
+ROWS_INSERTED = _metric("Counter", "scraper_rows_inserted_total", "Số nhãn hiệu được thêm vào DB")
+ROWS_SKIPPED = _metric("Counter", "scraper_rows_skipped_total", "Số hàng bị bỏ qua (đã có, trùng, không hợp lệ)")
+IMAGE_DOWNLOAD_BYTES = _metric("Counter", "scraper_image_download_bytes_total", "Số byte ảnh đã tải")
+IMAGE_DOWNLOAD_SECONDS = _metric("Histogram", "scraper_image_download_seconds", "Thời gian tải một ảnh",
+                                 buckets=LATENCY_BUCKETS)
+RATE_LIMIT_WAIT_SECONDS = _metric("Histogram", "scraper_rate_limiter_wait_seconds",
+                                  "Thời gian chờ token của rate limiter cho mỗi request", ("kind",),
+                                  buckets=(0.0, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+WORKERS_BUSY = _metric("Gauge", "scraper_workers_busy", "Số đơn vị việc đang được xử lý",
+                       multiprocess_mode="livesum")
+WORK_UNITS = _metric("Counter", "scraper_work_units_total", "Số đơn vị việc đã kết thúc theo trạng thái", ("status",))
+
+
+def observe_page_metrics(page_metrics: Dict[str, Any]) -> None:
+    source = page_metrics.get("source", "web")
+    PAGES_SCRAPED.labels(source).inc()
+    PAGE_FETCH_SECONDS.labels(source).observe(page_metrics.get("fetch_seconds", 0.0))
+    PAGE_PARSE_SECONDS.observe(page_metrics.get("parse_seconds", 0.0))
+    DB_WRITE_SECONDS.observe(page_metrics.get("db_seconds", 0.0))
+    ROWS_INSERTED.inc(page_metrics.get("rows_inserted", 0))
+    ROWS_SKIPPED.inc(page_metrics.get("rows_skipped", 0))
+
+
+def reset_metrics_dir() -> None:
+    # Gọi một lần khi manager khởi động, trước khi tạo worker: xóa số liệu của lần chạy trước
+    if prometheus_client is None:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.db")):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger_metrics.warning(f"Không thể xóa file metrics cũ {path}: {e}")
+
+
+def mark_process_dead(pid: int) -> None:
+    # Bỏ giá trị gauge "live" của process đã thoát để scraper_workers_busy không bị tính cả process cũ
+    if prometheus_client is None:
+        return
+    multiprocess.mark_process_dead(pid, METRICS_DIR)
+
+
+def render_latest() -> Optional[Tuple[bytes, str]]:
+    # Gộp số liệu của mọi process từ METRICS_DIR; None nếu metrics bị tắt
+    if prometheus_client is None:
+        return None
+    registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=METRICS_DIR)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,205 @@
+import re
+import logging
+from bs4 import BeautifulSoup
+from typing import List, NamedTuple, Optional
+from src.tools.config import settings
+
+logger_parser = logging.getLogger(__name__)
+
+ROWS_XPATH = "//table[contains(concat(' ', normalize-space(@class), ' '), ' table ')]//tbody//tr"
+# Link phân trang dạng /search?fd=...&p=N (có thể bị escape thành &amp;p=N)
+PAGE_LINK_PATTERN = re.compile(r'href="[^"]*/search\?[^"]*?[?&](?:amp;)?p=(\d+)')
+
+
+class ResultRow(NamedTuple):
+    # Giá trị thô của một hàng trong bảng kết quả, đã strip giống cách bóc tách cũ
+    application_date_text: str
+    brand_name: str
+    image_src: Optional[str]
+    product_group: str
+    status: str
+    application_number: str
+    applicant: str
+    representative: str
+    product_detail_href: Optional[str]
+
+
+class BeautifulSoupResultParser:
+    name = "html.parser"
+
+    def parse_rows(self, html: str) -> List[ResultRow]:
+        soup = BeautifulSoup(html, 'html.parser')
+        records = []
+        for row_idx, row in enumerate(soup.select("table.table tbody tr")):
+            try:
+                records.append(self._extract_row(row))
+            except Exception as e_row:
+                logger_parser.error(
+                    f"Lỗi bóc tách hàng {row_idx + 1}: {e_row}\nHTML Snippet: {str(row)[:250]}", exc_info=True)
+        return records
+
+    @staticmethod
+    def _extract_row(row) -> ResultRow:
+        # Duyệt các ô một lần, gán trường theo vị trí cột (tương đương td:nth-child(N)) và theo class
+        date_text = brand_name = product_group = status = application_number = applicant = representative = ""
+        image_src = None
+        product_detail_href = ""
+        image_found = status_found = False
+        for position, cell in enumerate(row.find_all(True, recursive=False), start=1):
+            if cell.name != "td":
+                continue
+            cell_classes = cell.get("class") or []
+            if not image_found and "mau-nhan" in cell_classes:
+                image_tag = cell.find("img")
+                if image_tag is not None:
+                    image_found = True
+                    image_src = image_tag.get("src")
+            if not status_found and "trang-thai" in cell_classes:
+                status_tag = cell.find("span", class_="badge")
+                if status_tag is not None:
+                    status_found = True
+                    status = status_tag.get_text().strip()
+
+            if position == 4:
+                brand_name_tag = cell.find("label")
+                brand_name = brand_name_tag.get_text().strip() if brand_name_tag else ""
+            elif position == 5:
+                product_group_values = [tag.get_text().strip() for tag in cell.find_all("span")]
+                product_group = ", ".join(value for value in product_group_values if value)
+            elif position == 7:
+                date_text = cell.get_text().strip()
+            elif position == 8:
+                application_number_tag = cell.find("a")
+                if application_number_tag is not None:
+                    application_number = application_number_tag.get_text().strip()
+                    product_detail_href = application_number_tag.get("href")
+            elif position == 9:
+                applicant = cell.get_text().strip()
+            elif position == 10:
+                representative = cell.get_text().strip()
+
+        return ResultRow(
+            application_date_text=date_text,
+            brand_name=brand_name,
+            image_src=image_src,
+            product_group=product_group,
+            status=status,
+            application_number=application_number,
+            applicant=applicant,
+            representative=representative,
+            product_detail_href=product_detail_href,
+        )
+
+
+class LxmlResultParser:
+    # Dùng lxml.html + XPath, cho ra cùng giá trị với BeautifulSoupResultParser nhưng nhanh hơn nhiều lần
+    name = "lxml"
+
+    def __init__(self):
+        try:
+            import lxml.html
+        except ImportError as e:
+            raise ImportError("HTML_PARSER_BACKEND=lxml cần cài đặt gói 'lxml'.") from e
+        self._lxml_html = lxml.html
+
+    def parse_rows(self, html: str) -> List[ResultRow]:
+        if not html or not html.strip():
+            return []
+        document = self._lxml_html.document_fromstring(html)
+        records = []
+        for row_idx, row in enumerate(document.xpath(ROWS_XPATH)):
+            try:
+                records.append(self._extract_row(row))
+            except Exception as e_row:
+                logger_parser.error(
+                    f"Lỗi bóc tách hàng {row_idx + 1}: {e_row}\nHTML Snippet: "
+                    f"{self._lxml_html.tostring(row, encoding='unicode')[:250]}", exc_info=True)
+        return records
+
+    @staticmethod
+    def _text(element) -> str:
+        return str(element.text_content()).strip()
+
+    def _extract_row(self, row) -> ResultRow:
+        # Cùng cách duyệt một lượt như BeautifulSoupResultParser; nth-child đếm mọi phần tử con, bỏ qua comment
+        date_text = brand_name = product_group = status = application_number = applicant = representative = ""
+        image_src = None
+        product_detail_href = ""
+        image_found = status_found = False
+        cells = [child for child in row if isinstance(child.tag, str)]
+        for position, cell in enumerate(cells, start=1):
+            if cell.tag != "td":
+                continue
+            cell_classes = (cell.get("class") or "").split()
+            if not image_found and "mau-nhan" in cell_classes:
+                image_tag = next(cell.iter("img"), None)
+                if image_tag is not None:
+                    image_found = True
+                    image_src = image_tag.get("src")
+            if not status_found and "trang-thai" in cell_classes:
+                status_tag = next((tag for tag in cell.iter("span") if "badge" in (tag.get("class") or "").split()), None)
+                if status_tag is not None:
+                    status_found = True
+                    status = self._text(status_tag)
+
+            if position == 4:
+                brand_name_tag = next(cell.iter("label"), None)
+                brand_name = self._text(brand_name_tag) if brand_name_tag is not None else ""
+            elif position == 5:
+                product_group_values = [self._text(tag) for tag in cell.iter("span")]
+                product_group = ", ".join(value for value in product_group_values if value)
+            elif position == 7:
+                date_text = self._text(cell)
+            elif position == 8:
+                application_number_tag = next(cell.iter("a"), None)
+                if application_number_tag is not None:
+                    application_number = self._text(application_number_tag)
+                    product_detail_href = application_number_tag.get("href")
+            elif position == 9:
+                applicant = self._text(cell)
+            elif position == 10:
+                representative = self._text(cell)
+
+        return ResultRow(
+            application_date_text=date_text,
+            brand_name=brand_name,
+            image_src=image_src,
+            product_group=product_group,
+            status=status,
+            application_number=application_number,
+            applicant=applicant,
+            representative=representative,
+            product_detail_href=product_detail_href,
+        )
+
+
+def parse_last_page_number(html: str) -> Optional[int]:
+    # Số trang lớn nhất xuất hiện trong các link phân trang; None nếu trang không có phân trang
+    page_numbers = [int(page) for page in PAGE_LINK_PATTERN.findall(html or "")]
+    return max(page_numbers) if page_numbers else None
+
+
+PARSER_BACKENDS = {
+    BeautifulSoupResultParser.name: BeautifulSoupResultParser,
+    LxmlResultParser.name: LxmlResultParser,
+}
+
+
+def get_result_parser(backend_name: Optional[str] = None):
+    backend_name = backend_name or settings.HTML_PARSER_BACKEND
+    parser_class = PARSER_BACKENDS.get(backend_name)
+    if parser_class is None:
+        logger_parser.warning(f"HTML_PARSER_BACKEND '{backend_name}' không hợp lệ. Dùng 'html.parser'.")
+        parser_class = BeautifulSoupResultParser
+    return parser_class()
+
+
+_parser_cache = {}
+
+
+def parse_result_rows(html: str, backend_name: str) -> List[ResultRow]:
+    # Hàm cấp module để gửi được sang ProcessPoolExecutor; mỗi process giữ một parser cho mỗi backend
+    parser = _parser_cache.get(backend_name)
+    if parser is None:
+        parser = _parser_cache[backend_name] = get_result_parser(backend_name)
+    return parser.parse_rows(html)
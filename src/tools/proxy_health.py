@@ -0,0 +1,108 @@
+import time
+import random
+import logging
+from typing import Dict, List, Optional, Any
+from src.tools.config import settings
+
+logger_proxy = logging.getLogger(__name__)
+
+# Status cho thấy proxy bị chặn/giới hạn; các lỗi 4xx/5xx khác đến từ website gốc nên không tính cho proxy
+PROXY_BLOCK_STATUS_CODES = (401, 403, 429)
+
+
+def proxy_label(proxy: Optional[str]) -> str:
+    # Dạng ip:port để log, không lộ user/password
+    return proxy.rsplit('@', 1)[-1] if proxy else "None"
+
+
+class ProxyStats:
+    def __init__(self, proxy: str, initial_latency: float):
+        self.proxy = proxy
+        self.latency_ewma = initial_latency
+        self.error_rate_ewma = 0.0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.rate_limited_count = 0
+        self.consecutive_failures = 0
+        self.trip_count = 0
+        self.benched_until = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "proxy": proxy_label(self.proxy),
+            "latency_ewma": round(self.latency_ewma, 3),
+            "error_rate_ewma": round(self.error_rate_ewma, 3),
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+            "rate_limited_count": self.rate_limited_count,
+            "benched_for_seconds": round(max(self.benched_until - time.monotonic(), 0.0), 1),
+        }
+
+
+class ProxyHealthTracker:
+    # Theo dõi độ trễ/lỗi của từng proxy, tạm loại (circuit breaker) proxy hỏng và ưu tiên proxy nhanh
+    def __init__(self, proxy_urls: List[str], ewma_alpha: Optional[float] = None, failure_threshold: Optional[int] = None,
+                 cooldown_seconds: Optional[float] = None, max_cooldown_seconds: Optional[float] = None):
+        self.ewma_alpha = ewma_alpha if ewma_alpha is not None else settings.PROXY_EWMA_ALPHA
+        self.failure_threshold = failure_threshold if failure_threshold is not None else settings.PROXY_FAILURE_THRESHOLD
+        self.cooldown_seconds = cooldown_seconds if cooldown_seconds is not None else settings.PROXY_COOLDOWN_SECONDS
+        self.max_cooldown_seconds = max_cooldown_seconds if max_cooldown_seconds is not None else settings.PROXY_MAX_COOLDOWN_SECONDS
+        initial_latency = max(settings.REQUEST_TIMEOUT / 4, 0.1)
+        self.stats: Dict[str, ProxyStats] = {proxy: ProxyStats(proxy, initial_latency) for proxy in proxy_urls}
+
+    def _weight(self, stats: ProxyStats) -> float:
+        return max(1.0 - stats.error_rate_ewma, 0.05) / max(stats.latency_ewma, 0.05)
+
+    def choose(self) -> Optional[str]:
+        if not self.stats:
+            return None
+        now = time.monotonic()
+        available = [stats for stats in self.stats.values() if stats.benched_until <= now]
+        if not available:
+            # Tất cả đều đang bị loại: dùng proxy sắp hết thời gian nghỉ nhất thay vì dừng hẳn
+            soonest = min(self.stats.values(), key=lambda stats: stats.benched_until)
+            logger_proxy.warning(
+                f"Tất cả proxy đang bị tạm loại. Dùng {proxy_label(soonest.proxy)} (còn {soonest.benched_until - now:.1f}s).")
+            return soonest.proxy
+        chosen = random.choices(available, weights=[self._weight(stats) for stats in available], k=1)[0]
+        return chosen.proxy
+
+    def record_success(self, proxy: Optional[str], latency_seconds: float) -> None:
+        stats = self.stats.get(proxy)
+        if stats is None:
+            return
+        alpha = self.ewma_alpha
+        stats.total_requests += 1
+        stats.latency_ewma = alpha * latency_seconds + (1 - alpha) * stats.latency_ewma
+        stats.error_rate_ewma = (1 - alpha) * stats.error_rate_ewma
+        stats.consecutive_failures = 0
+        stats.trip_count = 0
+
+    def record_failure(self, proxy: Optional[str], status_code: Optional[int] = None,
+                       latency_seconds: Optional[float] = None) -> None:
+        stats = self.stats.get(proxy)
+        if stats is None:
+            return
+        alpha = self.ewma_alpha
+        stats.total_requests += 1
+        stats.total_errors += 1
+        stats.error_rate_ewma = alpha + (1 - alpha) * stats.error_rate_ewma
+        if latency_seconds is not None:
+            stats.latency_ewma = alpha * latency_seconds + (1 - alpha) * stats.latency_ewma
+        stats.consecutive_failures += 1
+
+        is_blocked = status_code in PROXY_BLOCK_STATUS_CODES
+        if status_code == 429:
+            stats.rate_limited_count += 1
+        if is_blocked or stats.consecutive_failures >= self.failure_threshold:
+            # Mỗi lần bị loại liên tiếp thì thời gian nghỉ tăng gấp đôi (tối đa max_cooldown_seconds)
+            cooldown = min(self.cooldown_seconds * (2 ** stats.trip_count), self.max_cooldown_seconds)
+            stats.trip_count += 1
+            stats.consecutive_failures = 0
+            stats.benched_until = time.monotonic() + cooldown
+            logger_proxy.warning(
+                f"Tạm loại proxy {proxy_label(proxy)} trong {cooldown:.0f}s "
+                f"(status: {status_code or 'lỗi kết nối'}, tỉ lệ lỗi EWMA: {stats.error_rate_ewma:.2f}).")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [stats.to_dict() for stats in self.stats.values()]
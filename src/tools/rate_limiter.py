@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Optional, List, Tuple
+from src.tools.config import settings
+
+logger_rate = logging.getLogger(__name__)
+
+GLOBAL_BUCKET_KEY = "global"
+
+
+def get_rate_limit_db_path(project_root: str) -> str:
+    return os.path.join(project_root, "rate_limiter.sqlite3")
+
+
+def proxy_bucket_key(proxy: str) -> str:
+    # Bỏ thông tin đăng nhập khỏi key để không ghi mật khẩu proxy xuống đĩa
+    return f"proxy:{proxy.rsplit('@', 1)[-1]}"
+
+
+class TokenBucketRateLimiter:
+    # Token bucket dùng chung giữa các process thông qua một file SQLite (BEGIN IMMEDIATE để khóa ghi)
+    def __init__(self, db_path: str, rate_per_second: float, capacity: float,
+                 per_proxy_rate_per_second: float = 0.0, per_proxy_capacity: float = 0.0):
+        self.db_path = db_path
+        self.rate_per_second = rate_per_second
+        self.capacity = max(capacity, 1.0)
+        self.per_proxy_rate_per_second = per_proxy_rate_per_second
+        self.per_proxy_capacity = max(per_proxy_capacity, 1.0)
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connection_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, db_path: str) -> "TokenBucketRateLimiter":
+        interval = max(settings.REQUEST_INTERVAL_SECONDS, 1)
+        return cls(
+            db_path=db_path,
+            rate_per_second=settings.REQUEST_LIMIT_PER_INTERVAL / interval,
+            capacity=settings.REQUEST_LIMIT_PER_INTERVAL,
+            per_proxy_rate_per_second=settings.PER_PROXY_REQUEST_LIMIT_PER_INTERVAL / interval,
+            per_proxy_capacity=settings.PER_PROXY_REQUEST_LIMIT_PER_INTERVAL,
+        )
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS token_bucket (
+                    bucket_key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _buckets_for(self, proxy: Optional[str]) -> List[Tuple[str, float, float]]:
+        buckets = []
+        if self.rate_per_second > 0:
+            buckets.append((GLOBAL_BUCKET_KEY, self.rate_per_second, self.capacity))
+        if proxy and self.per_proxy_rate_per_second > 0:
+            buckets.append((proxy_bucket_key(proxy), self.per_proxy_rate_per_second, self.per_proxy_capacity))
+        return buckets
+
+    def _try_acquire(self, proxy: Optional[str]) -> float:
+        # Lấy 1 token ở mọi bucket liên quan trong cùng một transaction; trả về số giây cần chờ (0 = đã lấy được)
+        buckets = self._buckets_for(proxy)
+        if not buckets:
+            return 0.0
+        with self._lock:
+            conn = self._get_connection()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                refilled = []
+                for bucket_key, rate, capacity in buckets:
+                    row = conn.execute("SELECT tokens, updated_at FROM token_bucket WHERE bucket_key = ?",
+                                       (bucket_key,)).fetchone()
+                    tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0.0) * rate)
+                    refilled.append((bucket_key, rate, tokens))
+
+                wait_seconds = max((1.0 - tokens) / rate for _, rate, tokens in refilled)
+                acquired = wait_seconds <= 0
+                for bucket_key, _, tokens in refilled:
+                    conn.execute("INSERT OR REPLACE INTO token_bucket (bucket_key, tokens, updated_at) VALUES (?, ?, ?)",
+                                 (bucket_key, tokens - 1.0 if acquired else tokens, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return 0.0 if acquired else wait_seconds
+
+    async def acquire(self, proxy: Optional[str] = None) -> float:
+        waited_seconds = 0.0
+        while True:
+            try:
+                wait_seconds = await asyncio.to_thread(self._try_acquire, proxy)
+            except sqlite3.Error as e:
+                # Không để lỗi của file rate limit làm dừng việc cào
+                logger_rate.error(f"[RateLimiter] Lỗi khi lấy token: {e}. Bỏ qua giới hạn cho request này.")
+                return waited_seconds
+            if wait_seconds <= 0:
+                return waited_seconds
+            logger_rate.debug(f"[RateLimiter] Hết token, chờ {wait_seconds:.2f} giây.")
+            await asyncio.sleep(wait_seconds)
+            waited_seconds += wait_seconds
+
+    def close(self) -> None:
+        if self._connection is not None and self._connection_pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+        self._connection_pid = None
@@ -1,12 +1,17 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, HTTPException, Response
 import subprocess
 import sys
 import os
 from pathlib import Path
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
-from src.tools.state_manager import (load_control_state,get_all_in_progress_days,get_db_path)
+from datetime import date
+from src.tools.state_manager import (load_control_state,get_all_in_progress_days,get_db_path,get_day_performance,
+                                     get_stage_breakdown,get_slowest_pages)
+from src.tools.config import settings
+from src.tools.metrics import render_latest
 PROJECT_ROOT = Path(os.path.abspath(__file__)).parent.parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
@@ -108,16 +113,55 @@ async def stop_scraping():
         raise HTTPException(status_code=404, detail="Không có tiến trình nào đang chạy để dừng.")
 
     pid = scraper_process.pid
+    process_to_stop = scraper_process
     try:
-        scraper_process.terminate()
-        scraper_process.wait(timeout=10)
-        message = f"Tiến trình (PID: {pid}) đã được yêu cầu dừng."
+        # SIGTERM: run_scraper yêu cầu worker commit + checkpoint trang hiện tại rồi mới thoát.
+        # Chờ trong thread để /status, /metrics... vẫn trả lời trong lúc chờ (tối đa STOP_GRACE_SECONDS)
+        process_to_stop.terminate()
+        await asyncio.to_thread(process_to_stop.wait, settings.STOP_GRACE_SECONDS)
+        message = f"Tiến trình (PID: {pid}) đã dừng sau khi lưu checkpoint."
     except subprocess.TimeoutExpired:
-        scraper_process.kill()
+        process_to_stop.kill()
+        await asyncio.to_thread(process_to_stop.wait)
         message = f"Tiến trình (PID: {pid}) không phản hồi và đã bị buộc dừng."
 
     return StatusResponse(status="stopped", message=message, pid=pid)
 
+def _state_db_path_or_404() -> str:
+    state_db_path = get_db_path(str(PROJECT_ROOT))
+    if not os.path.exists(state_db_path):
+        raise HTTPException(status_code=404, detail="Chưa có state database.")
+    return state_db_path
+
+
+@app.get("/performance/days")
+async def performance_by_day(start: Optional[date] = None, end: Optional[date] = None, source: Optional[str] = None,
+                             limit: int = 50):
+    # Các ngày tốn thời gian nhất trong page_metrics
+    return get_day_performance(_state_db_path_or_404(), start, end, source, limit)
+
+
+@app.get("/performance/stages")
+async def performance_by_stage(start: Optional[date] = None, end: Optional[date] = None, source: Optional[str] = None):
+    # Tỉ lệ thời gian tải trang / parse / DB / ảnh, dùng để chọn CONCURRENT_SCRAPING_TASKS
+    return get_stage_breakdown(_state_db_path_or_404(), start, end, source)
+
+
+@app.get("/performance/pages")
+async def slowest_pages(start: Optional[date] = None, end: Optional[date] = None, source: Optional[str] = None,
+                        limit: int = 20):
+    return get_slowest_pages(_state_db_path_or_404(), start, end, source, limit)
+
+
+@app.get("/metrics")
+async def metrics():
+    rendered = render_latest()
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Metrics đang tắt hoặc chưa cài gói prometheus-client.")
+    content, content_type = rendered
+    return Response(content=content, media_type=content_type)
+
+
 @app.get('/')
 async def root():
     return "Chào mừng đến với Scraper Control API."
@@ -1,25 +1,56 @@
 import os
-import uuid
+import hashlib
+import tempfile
 import httpx
 import asyncio
+import time
 import random
 import logging
-from bs4 import BeautifulSoup
 from src.tools.models import Brand
 from src.tools.config import settings
-from src.tools.database import bulk_create
+from src.tools.database import bulk_load_brands, bulk_upsert_brands, find_existing_application_numbers
+from src.tools.http_client import HttpClientPool, build_proxy_urls
+from src.tools.media_store import MediaStore
+from src.tools.rate_limiter import TokenBucketRateLimiter
+from src.tools.proxy_health import PROXY_BLOCK_STATUS_CODES, ProxyHealthTracker, proxy_label
+from src.tools.html_archive import HtmlArchive
+from src.tools.parsers import get_result_parser, parse_last_page_number, parse_result_rows
+from src.tools.known_applications import KnownApplicationIndex
+from src.tools.metrics import (HTTP_REQUESTS, IMAGE_DOWNLOAD_BYTES, IMAGE_DOWNLOAD_SECONDS, RATE_LIMIT_WAIT_SECONDS,
+                               observe_page_metrics)
+from src.tools.tracing import record_span, span
 from urllib.parse import urlparse, unquote
+from collections import OrderedDict
+from concurrent.futures import Executor
 from sqlmodel import Session, select, or_, and_
-from typing import List, Optional, Callable, Dict, Any
+from typing import List, Optional, Callable, Dict, Any, Tuple
 from src.Exception.exceptions import CustomScrapingError
 from datetime import datetime, timezone, date as date_type, timedelta
 
 logger_service = logging.getLogger(__name__)
 
+# Số khoảng ngày giữ KnownApplicationIndex trong mỗi worker (các đơn vị việc theo khoảng trang của một ngày dùng chung)
+KNOWN_APPLICATION_CACHE_DAYS = 8
+
 class ScraperService:
-    def __init__(self, media_dir: str):    
+    def __init__(self, media_dir: str, media_index_path: Optional[str] = None,
+                 rate_limiter: Optional[TokenBucketRateLimiter] = None,
+                 html_archive: Optional[HtmlArchive] = None, offline: bool = False,
+                 parse_executor: Optional[Executor] = None, offload_db_calls: bool = False):    
         self.media_dir = media_dir    
-        self.proxy_index = 0
+        # parse_executor: pool (thread/process) để parse HTML; offload_db_calls: chạy truy vấn DB đồng bộ trong thread
+        # để nhiều coroutine dùng chung một event loop không bị chặn (chế độ EXECUTION_MODE=asyncio)
+        self.parse_executor = parse_executor
+        self.offload_db_calls = offload_db_calls
+        self.rate_limiter = rate_limiter
+        # offline: đọc trang từ html_archive, không gửi bất kỳ request nào
+        self.html_archive = html_archive
+        self.offline = offline
+        if offline and html_archive is None:
+            raise ValueError("Chế độ offline cần html_archive.")
+        self.media_store = MediaStore(media_dir, media_index_path)
+        self.proxy_urls = build_proxy_urls()
+        self.proxy_health = ProxyHealthTracker(self.proxy_urls)
         self.request_count = 0
         self.last_request_time = datetime.now()
         self.headers = {
@@ -30,28 +61,39 @@ class ScraperService:
             "DNT": "1",
             "Upgrade-Insecure-Requests": "1"
         }
+        self.client_pool = HttpClientPool(headers=self.headers)
+        self.result_parser = get_result_parser()
+        self.image_download_semaphore = asyncio.Semaphore(settings.IMAGE_DOWNLOAD_CONCURRENCY)
+        self._known_application_cache: "OrderedDict[Tuple[date_type, date_type], KnownApplicationIndex]" = OrderedDict()
+
+    async def close(self) -> None:
+        await self.client_pool.aclose()
+        self.media_store.close()
+        if self.rate_limiter:
+            self.rate_limiter.close()
+
+    async def _get_known_applications(self, session: Session, start_date: date_type,
+                                      end_date: date_type) -> KnownApplicationIndex:
+        # Nạp một lần cho mỗi worker và khoảng ngày, dùng lại cho các đơn vị việc sau của cùng ngày. Số đơn do process
+        # khác thêm sau lần nạp chỉ làm chỉ mục thiếu: các số đơn đó vẫn được hỏi DB nên kết quả không sai
+        cache_key = (start_date, end_date)
+        known_applications = self._known_application_cache.get(cache_key)
+        if known_applications is not None:
+            self._known_application_cache.move_to_end(cache_key)
+            return known_applications
+        known_applications = KnownApplicationIndex()
+        await self.run_db(known_applications.load, session, start_date, end_date)
+        self._known_application_cache[cache_key] = known_applications
+        while len(self._known_application_cache) > KNOWN_APPLICATION_CACHE_DAYS:
+            self._known_application_cache.popitem(last=False)
+        return known_applications
 
     def get_next_proxy(self) -> Optional[str]:
-        if not settings.PROXY_IPS or not settings.PROXY_PORTS:
+        proxy_str = self.proxy_health.choose()
+        if proxy_str is None:
             logger_service.debug("proxy hoặc ip rỗng . chạy không có proxy.")
             return None
-
-        has_auth = settings.PROXY_USERNAME and settings.PROXY_PASSWORD
-
-        if not (len(settings.PROXY_IPS) == len(settings.PROXY_PORTS)):
-            logger_service.error("lỗi config proxy: độ dài của proxy không trùng .")
-            return None
-
-        proxy_ip = settings.PROXY_IPS[self.proxy_index]
-        proxy_port = settings.PROXY_PORTS[self.proxy_index]
-
-        if has_auth:
-            proxy_str = f"socks5://{settings.PROXY_USERNAME}:{settings.PROXY_PASSWORD}@{proxy_ip}:{proxy_port}"
-        else:
-            proxy_str = f"socks5://{proxy_ip}:{proxy_port}"
-
-        self.proxy_index = (self.proxy_index + 1) % len(settings.PROXY_IPS)
-        logger_service.debug(f"dùng proxy số : {proxy_ip}:{proxy_port}")
+        logger_service.debug(f"dùng proxy số : {proxy_label(proxy_str)}")
         return proxy_str
 
     async def download_image(self, image_url_original: str, context: dict = None) -> str | None:
@@ -68,15 +110,26 @@ class ScraperService:
             logger_service.error(f"không thể tạo một thư mục  {full_save_folder_on_disk}: {e}")
             return None
 
-        try:
-            ssl_verify = getattr(settings, 'SSL_VERIFY_DOWNLOAD', True)
-            download_timeout = getattr(settings, 'DOWNLOAD_TIMEOUT', 30.0)
+        cached_relative_path = await asyncio.to_thread(self.media_store.lookup, image_url_original)
+        if cached_relative_path:
+            logger_service.debug(f"Ảnh {image_url_original} đã có trong media index: {cached_relative_path}. Không tải lại.")
+            return cached_relative_path
+        if self.offline:
+            logger_service.debug(f"[Offline] Ảnh {image_url_original} chưa có trong media index. Bỏ qua.")
+            return None
 
-            async with httpx.AsyncClient(verify=ssl_verify, timeout=download_timeout,
-                                         follow_redirects=True) as client:
-                logger_service.info(f"Đang cố gắng tải xuống hình ảnh từ: {image_url_original}")
-                img_response = await client.get(image_url_original, headers=self.headers)
+        try:
+            download_proxy = self.get_next_proxy()
+            if self.rate_limiter:
+                RATE_LIMIT_WAIT_SECONDS.labels("image").observe(await self.rate_limiter.acquire(download_proxy))
+            client = self.client_pool.get_client(download_proxy, kind="download")
+            logger_service.info(f"Đang cố gắng tải xuống hình ảnh từ: {image_url_original}")
+            download_started_at = time.monotonic()
+            async with client.stream("GET", image_url_original,
+                                     timeout=self.client_pool.timeout_for("download")) as img_response:
                 img_response.raise_for_status()
+                self.proxy_health.record_success(download_proxy, time.monotonic() - download_started_at)
+                HTTP_REQUESTS.labels("image", proxy_label(download_proxy), str(img_response.status_code)).inc()
                 parsed_url = urlparse(image_url_original)
                 path_component = unquote(parsed_url.path)
                 original_filename_from_url = os.path.basename(path_component)
@@ -110,42 +163,102 @@ class ScraperService:
                 logging.debug(
                     f"DEBUG download_image: Phần mở rộng cuối cùng được chọn: '{determined_ext}' (repr: {repr(determined_ext)})")
 
-                unique_filename_base = str(uuid.uuid4())
-                unique_filename = f"{unique_filename_base}{determined_ext}"
-                logging.debug(
-                    f"DEBUG download_image: Tên tệp duy nhất được tạo:'{unique_filename}' (repr: {repr(unique_filename)})")
-                save_path_on_disk = os.path.join(full_save_folder_on_disk, unique_filename)
+                max_bytes = settings.IMAGE_MAX_BYTES
+                content_length = img_response.headers.get("content-length", "")
+                if max_bytes and content_length.isdigit() and int(content_length) > max_bytes:
+                    logger_service.warning(
+                        f"Hình ảnh {image_url_original} quá lớn ({content_length} bytes > {max_bytes} bytes). Bỏ qua.")
+                    return None
 
-                with open(save_path_on_disk, "wb") as f:
-                    f.write(img_response.content)
+                streamed = await self._stream_response_to_file(img_response, full_save_folder_on_disk, max_bytes)
+                if streamed is None:
+                    logger_service.warning(
+                        f"Hình ảnh {image_url_original} vượt quá giới hạn {max_bytes} bytes khi tải. Đã hủy tệp tạm.")
+                    return None
 
-                # Lấy tên của thư mục con cuối cùng từ self.media_dir
-                image_subfolder_name = os.path.basename(self.media_dir)    
-                relative_url_path = os.path.join(image_subfolder_name, unique_filename).replace("\\", "/")    
+            tmp_path, content_sha256, written_bytes = streamed
+            IMAGE_DOWNLOAD_BYTES.inc(written_bytes)
+            IMAGE_DOWNLOAD_SECONDS.observe(time.monotonic() - download_started_at)
+            relative_url_path = await asyncio.to_thread(
+                self.media_store.store_file, tmp_path, content_sha256, determined_ext)
+            await asyncio.to_thread(
+                self.media_store.record, image_url_original, relative_url_path, content_sha256, written_bytes)
 
-                logger_service.info(
-                    f"Hình ảnh đã được tải xuống thành công: {save_path_on_disk}. Phần URL tương đối: {relative_url_path}")
-                logging.debug(
-                    f"DEBUG download_image: Đường dẫn URL tương đối cần trả về: '{relative_url_path}' (repr: {repr(relative_url_path)})")
-                return relative_url_path
+            logger_service.info(
+                f"Hình ảnh đã được tải xuống thành công ({written_bytes} bytes). Phần URL tương đối: {relative_url_path}")
+            logging.debug(
+                f"DEBUG download_image: Đường dẫn URL tương đối cần trả về: '{relative_url_path}' (repr: {repr(relative_url_path)})")
+            return relative_url_path
 
         except httpx.HTTPStatusError as e_http:
-            error_text = e_http.response.text if hasattr(e_http, 'response') and e_http.response and hasattr(
-                e_http.response, 'text') else str(e_http)
+            # Response ở chế độ stream chưa được đọc nên không lấy .text
             status_code_text = e_http.response.status_code if hasattr(e_http, 'response') and hasattr(e_http.response,'status_code') else 'N/A'
-            logger_service.error(f"HTTP lỗi  {status_code_text} tải image {image_url_original}: {error_text}")
+            logger_service.error(f"HTTP lỗi  {status_code_text} tải image {image_url_original}: {str(e_http)}")
+            HTTP_REQUESTS.labels("image", proxy_label(download_proxy), str(status_code_text)).inc()
+            if status_code_text in PROXY_BLOCK_STATUS_CODES:
+                self.proxy_health.record_failure(download_proxy, status_code_text)
             return None
         except httpx.RequestError as e_req:
             logger_service.error(f"Yêu cầu tải xuống hình ảnh lỗi {image_url_original}: {str(e_req)}")
+            HTTP_REQUESTS.labels("image", proxy_label(download_proxy), "error").inc()
+            self.proxy_health.record_failure(download_proxy)
             return None
         except Exception as e:
             logger_service.error(f"Lỗi chung khi tải hình ảnh {image_url_original}: {str(e)}", exc_info=True)
             return None
 
-    async def make_request(self, url: str, max_retries: Optional[int] = None) -> Optional[httpx.Response]:
+    @staticmethod
+    async def _stream_response_to_file(response: httpx.Response, tmp_dir: str, max_bytes: int) -> Optional[Tuple[str, str, int]]:
+        # Ghi từng chunk ra tệp tạm trong thread riêng và tính sha256; trả về None nếu vượt max_bytes
+        fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=tmp_dir, suffix=".part")
+        tmp_file = os.fdopen(fd, "wb")
+        content_hash = hashlib.sha256()
+        written_bytes = 0
+        try:
+            async for chunk in response.aiter_bytes(settings.IMAGE_STREAM_CHUNK_SIZE):
+                written_bytes += len(chunk)
+                if max_bytes and written_bytes > max_bytes:
+                    await asyncio.to_thread(tmp_file.close)
+                    await asyncio.to_thread(os.remove, tmp_path)
+                    return None
+                content_hash.update(chunk)
+                await asyncio.to_thread(tmp_file.write, chunk)
+            await asyncio.to_thread(tmp_file.close)
+            return tmp_path, content_hash.hexdigest(), written_bytes
+        except BaseException:
+            tmp_file.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def download_page_images(self, image_urls: List[Optional[str]]) -> Dict[str, Optional[str]]:
+        unique_urls = list(dict.fromkeys(url for url in image_urls if url))
+        if not unique_urls:
+            return {}
+
+        async def _bounded_download(url: str) -> Optional[str]:
+            async with self.image_download_semaphore:
+                with span("download_image", url=url):
+                    return await self.download_image(url)
+
+        results = await asyncio.gather(*(_bounded_download(url) for url in unique_urls), return_exceptions=True)
+        saved_paths: Dict[str, Optional[str]] = {}
+        for url, result in zip(unique_urls, results):
+            if isinstance(result, BaseException):
+                logger_service.error(f"Lỗi khi tải song song hình ảnh {url}: {result}")
+                saved_paths[url] = None
+            else:
+                saved_paths[url] = result
+        return saved_paths
+
+    async def make_request(self, url: str, max_retries: Optional[int] = None,
+                           request_stats: Optional[Dict[str, Any]] = None) -> Optional[httpx.Response]:
+        # request_stats: nếu truyền vào thì được ghi số lần thử ("attempts") để tính số lần retry của trang
         effective_max_retries = max_retries if max_retries is not None else settings.MAX_REQUEST_RETRIES
         current_proxy = self.get_next_proxy()
         for attempt in range(effective_max_retries):
+            if request_stats is not None:
+                request_stats["attempts"] = attempt + 1
             try:
                 min_delay_req = settings.MIN_REQUEST_DELAY
                 max_delay_req = settings.MAX_REQUEST_DELAY
@@ -155,16 +268,17 @@ class ScraperService:
                     logger_service.info(f"Thử lại {url} sau {retry_delay:.2f} giây...")
                     await asyncio.sleep(retry_delay)
 
-                async with httpx.AsyncClient(
-                        timeout=httpx.Timeout(settings.REQUEST_TIMEOUT),
-                        verify=settings.SSL_VERIFY_REQUEST,
-                        follow_redirects=True,
-                ) as client:
-                    logging.debug(
-                        f"Making request to {url} (Attempt {attempt + 1}/{effective_max_retries}) with proxy {current_proxy or 'None'}")
-                    response = await client.get(url, headers=self.headers)
-                    response.raise_for_status()
-                    return response
+                if self.rate_limiter:
+                    RATE_LIMIT_WAIT_SECONDS.labels("page").observe(await self.rate_limiter.acquire(current_proxy))
+                client = self.client_pool.get_client(current_proxy)
+                logging.debug(
+                    f"Making request to {url} (Attempt {attempt + 1}/{effective_max_retries}) with proxy {proxy_label(current_proxy)}")
+                request_started_at = time.monotonic()
+                response = await client.get(url, timeout=self.client_pool.timeout_for("page"))
+                HTTP_REQUESTS.labels("page", proxy_label(current_proxy), str(response.status_code)).inc()
+                response.raise_for_status()
+                self.proxy_health.record_success(current_proxy, time.monotonic() - request_started_at)
+                return response
 
             except httpx.HTTPStatusError as e_http:
                 error_text = e_http.response.text if hasattr(e_http, 'response') and e_http.response and hasattr(
@@ -173,8 +287,9 @@ class ScraperService:
                                                                                                      'status_code') else None
                 logger_service.warning(
                     f"Lỗi trạng thái HTTP (Cố gắng {attempt + 1}/{effective_max_retries}) for {url}: {status_code or 'N/A'} - {error_text}")
-
-                if status_code in [403, 401, 429]:
+                # Chỉ status bị chặn mới tính là lỗi của proxy; 404/500... từ website gốc không làm proxy bị tạm loại
+                if status_code in PROXY_BLOCK_STATUS_CODES:
+                    self.proxy_health.record_failure(current_proxy, status_code, time.monotonic() - request_started_at)
                     logger_service.error(
                         f"Lỗi HTTP nghiêm trọng {status_code} for {url}. Thay đổi proxy và thử lại nếu có thể.")
                     current_proxy = self.get_next_proxy()
@@ -189,6 +304,8 @@ class ScraperService:
             except httpx.RequestError as e_req:
                 logger_service.warning(
                     f"Yêu cầu Lỗi (Cố gắng {attempt + 1}/{effective_max_retries}) for {url}: {str(e_req)}")
+                self.proxy_health.record_failure(current_proxy)
+                HTTP_REQUESTS.labels("page", proxy_label(current_proxy), "error").inc()
                 current_proxy = self.get_next_proxy()
                 if attempt == effective_max_retries - 1: logger_service.error(
                     f"Thử lại lần cuối thất bại cho {url} với lỗi request: {str(e_req)}."); return None
@@ -205,9 +322,40 @@ class ScraperService:
         logger_service.error(f"All {effective_max_retries} thử lại không thành công cho URL: {url}")
         return None
 
-    async def scrape_by_date_range(self, start_date: date_type, end_date: date_type, session: Session,initial_start_page: int, state_save_callback: Callable[[int], None]) -> Dict[str, Any]:
+    async def scrape_by_date_range(self, start_date: date_type, end_date: date_type, session: Session,initial_start_page: int, state_save_callback: Callable[[int], None],
+                                   end_page: Optional[int] = None, split_pages: int = 0,
+                                   split_callback: Optional[Callable[[int, int], None]] = None,
+                                   stop_requested: Optional[Callable[[], bool]] = None,
+                                   stop_on_known_page: bool = False,
+                                   page_metrics_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        # end_page: dừng sau trang này (đơn vị việc theo khoảng trang).
+        # split_pages > 0, split_callback và end_page None (đơn vị cả ngày): đọc số trang từ phân trang của trang đầu tiên;
+        # nếu ngày có nhiều hơn split_pages trang thì gọi ngay split_callback(trang_đầu_còn_lại, số_trang) để các trang
+        # còn lại được đưa vào hàng đợi cho worker khác, còn worker này chỉ cào tới trang split_pages.
+        # stop_requested: được kiểm tra giữa các trang; khi True thì commit + checkpoint trang đã xong rồi trả về "preempted".
+        # stop_on_known_page (chế độ tail): dừng ngày ngay khi gặp một trang mà mọi số đơn đều đã có trong DB
+        # page_metrics_callback: nhận số liệu của từng trang (thời gian tải/parse/DB/ảnh, số byte, số hàng, retry)
         current_page = initial_start_page
-        brands_collected_in_this_run: List[Brand] = []
+        discovered_page_count: Optional[int] = None
+        # Chỉ giữ bộ đếm: Brand được ghi bằng câu lệnh Core (INSERT nhiều dòng/COPY), không add vào session,
+        # nên các trang đã commit không để lại object nào trong bộ nhớ
+        brands_committed_count = 0
+        brands_pending_commit_count = 0
+        pages_pending_commit: List[int] = []
+        pages_per_commit = max(settings.PAGES_PER_COMMIT, 1)
+        known_applications: Optional[KnownApplicationIndex] = None
+        # Offline (nạp lại từ archive) ghi đè bản ghi đã có nên không cần biết số đơn nào đã tồn tại
+        if settings.KNOWN_APPLICATION_INDEX_ENABLED and not self.offline:
+            known_applications = await self._get_known_applications(session, start_date, end_date)
+        # Chỉ mục được dùng lại sau đơn vị việc này nên số đơn chỉ được thêm vào sau khi commit thành công
+        pending_known_numbers: List[str] = []
+
+        def on_pages_committed(last_page: int) -> None:
+            if known_applications is not None:
+                known_applications.add_many(pending_known_numbers)
+            pending_known_numbers.clear()
+            state_save_callback(last_page)
+
         request_limit_per_interval = settings.REQUEST_LIMIT_PER_INTERVAL
         request_interval_seconds = settings.REQUEST_INTERVAL_SECONDS
         min_request_delay = settings.MIN_REQUEST_DELAY
@@ -218,9 +366,53 @@ class ScraperService:
             "brands_processed_count": 0,
             "message": "Scraping did not complete as expected."
         }
+        archived_pages: Optional[Dict[int, str]] = None
+        if self.offline:
+            archived_pages = await asyncio.to_thread(self.html_archive.load_day, start_date)
+            logger_service.info(
+                f"[Offline] Đọc {len(archived_pages)} trang đã lưu của ngày {start_date.strftime('%Y-%m-%d')} từ archive.")
+            if not archived_pages:
+                # Lần cào online luôn lưu ít nhất trang 1 (kể cả trang rỗng), nên archive rỗng là archive bị hỏng
+                return {
+                    "status": "archive_incomplete",
+                    "brands_processed_count": 0,
+                    "missing_pages": [initial_start_page],
+                    "message": f"No readable archived page for day {start_date.strftime('%d.%m.%Y')}."
+                }
+        last_archived_page = max(archived_pages) if archived_pages else 0
+        missing_archive_pages: List[int] = []
 
         while True:
-            if self.request_count >= request_limit_per_interval:
+            if end_page is not None and current_page > end_page:
+                if pages_pending_commit:
+                    brands_committed_count += await self._commit_pages(
+                        session, pages_pending_commit, brands_pending_commit_count,
+                        start_date.strftime("%d.%m.%Y"), on_pages_committed)
+                    pages_pending_commit, brands_pending_commit_count = [], 0
+                scrape_status_result = {
+                    "status": "completed_range",
+                    "brands_processed_count": brands_committed_count,
+                    "message": f"Successfully scraped pages {initial_start_page}-{end_page} for day {start_date.strftime('%d.%m.%Y')}."
+                }
+                break
+
+            if stop_requested is not None and stop_requested():
+                if pages_pending_commit:
+                    brands_committed_count += await self._commit_pages(
+                        session, pages_pending_commit, brands_pending_commit_count,
+                        start_date.strftime("%d.%m.%Y"), on_pages_committed)
+                    pages_pending_commit, brands_pending_commit_count = [], 0
+                logger_service.info(
+                    f"Nhận yêu cầu dừng. Ngày {start_date.strftime('%d.%m.%Y')} dừng trước trang {current_page}, sẽ tiếp tục sau.")
+                scrape_status_result = {
+                    "status": "preempted",
+                    "brands_processed_count": brands_committed_count,
+                    "message": f"Stopped before page {current_page} for day {start_date.strftime('%d.%m.%Y')}."
+                }
+                break
+
+            # Khi có rate limiter dùng chung thì make_request tự chờ token, chỉ giữ giới hạn nội bộ cho trường hợp không có
+            if not self.offline and self.rate_limiter is None and self.request_count >= request_limit_per_interval:
                 time_diff = datetime.now() - self.last_request_time
                 if time_diff.total_seconds() < request_interval_seconds:
                     sleep_duration = request_interval_seconds - time_diff.total_seconds()
@@ -233,44 +425,85 @@ class ScraperService:
             start_str = start_date.strftime("%d.%m.%Y")
             end_str = end_date.strftime("%d.%m.%Y")
             url = f"https://vietnamtrademark.net/search?fd={start_str}%20-%20{end_str}&p={current_page}"
-
-            logger_service.info(
-                f"Đang cào trang: {current_page} cho ngày {start_str} (URL: {url})")
-            response = await self.make_request(url)
-            self.request_count += 1
-
-            if not response:
-                logger_service.error(
-                    f"Không nhận được phản hồi cho trang {current_page} (URL: {url}).")
-                # Ném lỗi ra ngoài để worker bắt được
-                raise CustomScrapingError(
-                    message="Failed to get response from make_request.",
-                    page=current_page,
-                    day=start_date.strftime('%Y-%m-%d'),
-                    original_error=Exception("Make_request returned None") # Tạo một lỗi gốc để mô tả
-                )
-
+            page_started_at = time.monotonic()
+            page_metrics: Dict[str, Any] = {"day": start_date.strftime("%Y-%m-%d"), "page": current_page,
+                                            "source": "archive" if self.offline else "web"}
+
+            if archived_pages is not None:
+                # Lỗ hổng trong archive (ngày từng chạy tiếp giữa chừng, bật archive muộn, gzip member hỏng) được bỏ qua
+                # và ghi lại; chỉ sau trang cuối cùng có trong archive mới coi như hết ngày
+                if current_page not in archived_pages and current_page < last_archived_page:
+                    logger_service.warning(
+                        f"[Offline] Trang {current_page} ngày {start_str} không có trong archive. Bỏ qua.")
+                    missing_archive_pages.append(current_page)
+                    current_page += 1
+                    continue
+                page_html = archived_pages.get(current_page, "")
+            else:
+                logger_service.info(
+                    f"Đang cào trang: {current_page} cho ngày {start_str} (URL: {url})")
+                request_stats: Dict[str, Any] = {}
+                with span("make_request", day=start_str, page=current_page):
+                    response = await self.make_request(url, request_stats=request_stats)
+                self.request_count += 1
+                page_metrics["retries"] = max(request_stats.get("attempts", 1) - 1, 0)
+
+                if not response:
+                    logger_service.error(
+                        f"Không nhận được phản hồi cho trang {current_page} (URL: {url}).")
+                    # Ném lỗi ra ngoài để worker bắt được
+                    raise CustomScrapingError(
+                        message="Failed to get response from make_request.",
+                        page=current_page,
+                        day=start_date.strftime('%Y-%m-%d'),
+                        original_error=Exception("Make_request returned None") # Tạo một lỗi gốc để mô tả
+                    )
+                page_html = response.text
+                page_metrics["html_bytes"] = len(response.content)
+                if self.html_archive is not None:
+                    try:
+                        with span("archive_page", page=current_page):
+                            await asyncio.to_thread(self.html_archive.append_page, start_date, current_page, url, page_html)
+                    except OSError as e_archive:
+                        logger_service.error(f"[Archive] Lỗi khi lưu HTML trang {current_page} ngày {start_str}: {e_archive}")
+            if archived_pages is not None:
+                page_metrics["html_bytes"] = len(page_html.encode("utf-8"))
+            page_metrics["fetch_seconds"] = time.monotonic() - page_started_at
+
+            parse_started_at = time.monotonic()
             try:
-                soup = BeautifulSoup(response.text, 'html.parser')
+                with span("parse", page=current_page, parser=self.result_parser.name):
+                    if self.parse_executor is not None:
+                        rows = await asyncio.get_running_loop().run_in_executor(
+                            self.parse_executor, parse_result_rows, page_html, self.result_parser.name)
+                    elif settings.HTML_PARSE_IN_THREAD:
+                        rows = await asyncio.to_thread(self.result_parser.parse_rows, page_html)
+                    else:
+                        rows = self.result_parser.parse_rows(page_html)
             except Exception as e_soup:
                 logger_service.error(f"Lỗi khi parse HTML cho trang {current_page} ngày {start_str}: {e_soup}",
                               exc_info=True)
                 raise CustomScrapingError(
-                    message="Failed to parse HTML with BeautifulSoup.",
+                    message=f"Failed to parse HTML with parser backend '{self.result_parser.name}'.",
                     page=current_page,
                     day=start_str,
                     original_error=e_soup
                 )
+            page_metrics["parse_seconds"] = time.monotonic() - parse_started_at
+            page_metrics["rows_parsed"] = len(rows)
 
-
-            rows = soup.select("table.table tbody tr")
             if not rows:
+                self._emit_page_metrics(page_metrics_callback, page_metrics, page_started_at)
+                if pages_pending_commit:
+                    brands_committed_count += await self._commit_pages(
+                        session, pages_pending_commit, brands_pending_commit_count, start_str, on_pages_committed)
+                    pages_pending_commit, brands_pending_commit_count = [], 0
                 if current_page == 1:
                     logger_service.info(
                         f"Không tìm thấy dữ liệu nào trên trang {current_page} cho ngày {start_str}. Có thể ngày này không có nhãn hiệu.")
                     scrape_status_result = {
                         "status": "no_data_on_first_page",
-                        "brands_processed_count": len(brands_collected_in_this_run),
+                        "brands_processed_count": brands_committed_count,
                         "message": f"No data found on the first page for day {start_str}."
                     }
                 else:
@@ -278,25 +511,42 @@ class ScraperService:
                         f"Không tìm thấy hàng (dữ liệu) nào trên trang {current_page} cho ngày {start_str}. Kết thúc cho ngày này.")
                     scrape_status_result = {
                         "status": "completed_all_pages",
-                        "brands_processed_count": len(brands_collected_in_this_run),
+                        "brands_processed_count": brands_committed_count,
                         "message": f"Successfully scraped all pages for day {start_str}."
                     }
                 break
 
+            if split_pages > 0 and split_callback is not None and end_page is None and discovered_page_count is None:
+                discovered_page_count = parse_last_page_number(page_html) or current_page
+                # Điểm chia cố định (trang split_pages) để chạy tiếp sau khi bị dừng tạo lại đúng các đơn vị đã có
+                split_end_page = max(split_pages, current_page)
+                if discovered_page_count > split_end_page:
+                    try:
+                        await self.run_db(split_callback, split_end_page + 1, discovered_page_count)
+                    except Exception as e_split:
+                        logger_service.error(
+                            f"Không đưa được các trang {split_end_page + 1}-{discovered_page_count} ngày {start_str} "
+                            f"vào hàng đợi: {e_split}. Worker này cào cả ngày.", exc_info=True)
+                    else:
+                        end_page = split_end_page
+                        logger_service.info(
+                            f"Ngày {start_str} có {discovered_page_count} trang. Worker này cào tới trang {end_page}, "
+                            f"phần còn lại đã được chia cho worker khác.")
+
             brands_extracted_from_this_page: List[Brand] = []
+            pending_rows: List[Dict[str, Any]] = []
             page_had_new_valid_data = False
             for row_idx, row in enumerate(rows):
                 try:
-                    date_text_tag = row.select_one("td:nth-child(7)")
-                    if not date_text_tag or not date_text_tag.text.strip():
+                    if not row.application_date_text:
                         logger_service.warning(
                             f"Hàng {row_idx + 1} trang {current_page} ngày {start_str}: Thiếu ngày nộp đơn. Bỏ qua hàng.")
                         continue
                     try:
-                        parsed_application_date = datetime.strptime(date_text_tag.text.strip(), "%d.%m.%Y").date()
+                        parsed_application_date = datetime.strptime(row.application_date_text, "%d.%m.%Y").date()
                     except ValueError as ve:
                         logger_service.warning(
-                            f"Hàng {row_idx + 1} trang {current_page} ngày {start_str}: Lỗi parse ngày '{date_text_tag.text.strip()}': {ve}. Bỏ qua hàng.")
+                            f"Hàng {row_idx + 1} trang {current_page} ngày {start_str}: Lỗi parse ngày '{row.application_date_text}': {ve}. Bỏ qua hàng.")
                         continue
 
                     if not (
@@ -306,87 +556,120 @@ class ScraperService:
                             f"nằm ngoài khoảng đang scrape ({start_date.strftime('%Y-%m-%d')} - {end_date.strftime('%Y-%m-%d')}). Bỏ qua.")
                         continue
 
-
-
-                    brand_name_tag = row.select_one("td:nth-child(4) label")
-                    brand_name = brand_name_tag.text.strip() if brand_name_tag else ""
-
-                    image_tag = row.select_one("td.mau-nhan img")
-                    image_url_original_src = image_tag["src"] if image_tag and image_tag.has_attr("src") else None
-                    final_image_url_for_db = None
-                    if image_url_original_src:
-                        current_image_url_to_download = image_url_original_src
+                    current_image_url_to_download = None
+                    if row.image_src:
+                        current_image_url_to_download = row.image_src
                         if current_image_url_to_download.startswith("/"):
                             current_image_url_to_download = f"{settings.SOURCE_WEBSITE_DOMAIN.rstrip('/')}{current_image_url_to_download}"    
-                        saved_relative_image_path = await self.download_image(current_image_url_to_download)
-                        if saved_relative_image_path:
-                            final_image_url_for_db = f"{settings.LOCAL_MEDIA_BASE_URL.rstrip('/')}/{saved_relative_image_path.lstrip('/')}"    
-
-                    product_group_tags = row.select("td:nth-child(5) span")
-                    if product_group_tags:
-                        product_group_values = [tag.text.strip() for tag in product_group_tags if tag.text.strip()]
-                        product_group = ", ".join(product_group_values)
-                    else:
-                        product_group = ""
-
-                    status_tag = row.select_one("td.trang-thai span.badge")
-                    status = status_tag.text.strip() if status_tag else ""
 
-                    application_number_tag = row.select_one("td:nth-child(8) a")
-                    application_number = application_number_tag.text.strip() if application_number_tag else ""
+                    application_number = row.application_number
                     if not application_number:
                         logger_service.warning(
                             f"Hàng {row_idx + 1} trang {current_page} ngày {start_str}: Thiếu số đơn. Bỏ qua hàng.")
                         continue
 
-                    applicant_tag = row.select_one("td:nth-child(9)")
-                    applicant = applicant_tag.text.strip() if applicant_tag else ""
+                    product_detail_href = row.product_detail_href
 
-                    representative_tag = row.select_one("td:nth-child(10)")
-                    representative = representative_tag.text.strip() if representative_tag else ""
-
-                    product_detail_tag = row.select_one("td:nth-child(8) a")
-                    product_detail_href = product_detail_tag.get(
-                        "href") if product_detail_tag else ""
-
-                    stmt = select(Brand).where(Brand.application_number == application_number)
-                    existing_brand = session.exec(stmt).first()
-
-                    if existing_brand:
-                        logger_service.info(
-                            f"Brand với số đơn {application_number} (trang {current_page}, ngày {start_str}) đã tồn tại. Bỏ qua.")
-                        continue
-
-                    brand_obj = Brand(
-                        brand_name=brand_name,
-                        image_url=final_image_url_for_db if final_image_url_for_db else "",
-                        product_group=product_group,
-                        status=status,
-                        application_date=parsed_application_date,
-                        application_number=application_number,
-                        applicant=applicant,
-                        representative=representative,
-                        product_detail=f"{settings.SOURCE_WEBSITE_DOMAIN.rstrip('/')}{product_detail_href}" if product_detail_href else ""
-
-
-                    )
-                    brands_extracted_from_this_page.append(brand_obj)
-                    page_had_new_valid_data = True
+                    pending_rows.append({
+                        "image_url_to_download": current_image_url_to_download,
+                        "brand_name": row.brand_name,
+                        "product_group": row.product_group,
+                        "status": row.status,
+                        "application_date": parsed_application_date,
+                        "application_number": application_number,
+                        "applicant": row.applicant,
+                        "representative": row.representative,
+                        "product_detail": f"{settings.SOURCE_WEBSITE_DOMAIN.rstrip('/')}{product_detail_href}" if product_detail_href else ""
+                    })
 
                 except Exception as e_row_processing:
-                    row_html_snippet = str(row)[:250]
                     logger_service.error(
-                        f"Lỗi xử lý hàng {row_idx + 1} trên trang {current_page} ngày {start_str}: {e_row_processing}\nHTML Snippet: {row_html_snippet}",
+                        f"Lỗi xử lý hàng {row_idx + 1} trên trang {current_page} ngày {start_str}: {e_row_processing}\nDữ liệu hàng: {row}",
                         exc_info=True)
                     continue
 
+            # Tra chỉ mục số đơn đã biết trước; chỉ số đơn chưa biết mới cần một truy vấn (trong partition của ngày)
+            page_application_numbers = [pending["application_number"] for pending in pending_rows]
+            db_started_at = time.monotonic()
+            with span("dedup_query", page=current_page, rows=len(page_application_numbers)):
+                if self.offline:
+                    # Kết quả bóc tách mới (sửa parser, thêm trường) phải tới được cả các bản ghi đã có: upsert bên dưới
+                    existing_application_numbers = set()
+                elif known_applications is not None:
+                    numbers_to_check = known_applications.unknown(page_application_numbers)
+                    existing_application_numbers = set(page_application_numbers) - set(numbers_to_check)
+                    if numbers_to_check:
+                        existing_application_numbers |= await self.run_db(
+                            find_existing_application_numbers, session, numbers_to_check, start_date, end_date)
+                else:
+                    existing_application_numbers = await self.run_db(
+                        find_existing_application_numbers, session, page_application_numbers, start_date, end_date)
+            page_metrics["db_seconds"] = time.monotonic() - db_started_at
+            if stop_on_known_page and page_application_numbers and all(
+                    number in existing_application_numbers for number in page_application_numbers):
+                if pages_pending_commit:
+                    brands_committed_count += await self._commit_pages(
+                        session, pages_pending_commit, brands_pending_commit_count, start_str, on_pages_committed)
+                    pages_pending_commit, brands_pending_commit_count = [], 0
+                logger_service.info(
+                    f"Trang {current_page} ngày {start_str} chỉ gồm số đơn đã biết. Dừng quét ngày này (tail).")
+                page_metrics["rows_skipped"] = len(rows)
+                self._emit_page_metrics(page_metrics_callback, page_metrics, page_started_at)
+                scrape_status_result = {
+                    "status": "completed_known_page",
+                    "brands_processed_count": brands_committed_count,
+                    "message": f"Stopped at fully known page {current_page} for day {start_str}."
+                }
+                break
+
+            new_pending_rows = []
+            seen_on_page = set()
+            for pending in pending_rows:
+                application_number = pending["application_number"]
+                if application_number in existing_application_numbers or application_number in seen_on_page:
+                    logger_service.info(
+                        f"Brand với số đơn {application_number} (trang {current_page}, ngày {start_str}) đã tồn tại. Bỏ qua.")
+                    continue
+                seen_on_page.add(application_number)
+                new_pending_rows.append(pending)
+            pending_rows = new_pending_rows
+
+            # Tải song song ảnh của cả trang rồi mới tạo các Brand
+            image_started_at = time.monotonic()
+            with span("download_page_images", page=current_page, rows=len(pending_rows)):
+                saved_image_paths = await self.download_page_images(
+                    [pending["image_url_to_download"] for pending in pending_rows])
+            page_metrics["image_seconds"] = time.monotonic() - image_started_at
+            page_metrics["images_fetched"] = sum(1 for saved_path in saved_image_paths.values() if saved_path)
+            for pending in pending_rows:
+                image_url_to_download = pending.pop("image_url_to_download")
+                saved_relative_image_path = saved_image_paths.get(image_url_to_download) if image_url_to_download else None
+                final_image_url_for_db = None
+                if saved_relative_image_path:
+                    final_image_url_for_db = f"{settings.LOCAL_MEDIA_BASE_URL.rstrip('/')}/{saved_relative_image_path.lstrip('/')}"
+                brand_obj = Brand(image_url=final_image_url_for_db if final_image_url_for_db else "", **pending)
+                brands_extracted_from_this_page.append(brand_obj)
+                page_had_new_valid_data = True
+
             if brands_extracted_from_this_page:
                 logger_service.info(
                     f"Trang {current_page} ngày {start_str}: Trích xuất được {len(brands_extracted_from_this_page)} nhãn hiệu mới.")
                 try:
-                    bulk_create(session, brands_extracted_from_this_page)
-                    brands_collected_in_this_run.extend(brands_extracted_from_this_page)
-                    state_save_callback(current_page)
+                    db_started_at = time.monotonic()
+                    with span("bulk_insert", page=current_page, rows=len(brands_extracted_from_this_page),
+                              mode="upsert" if self.offline else settings.BRAND_BULK_LOAD_MODE):
+                        inserted_count = await self.run_db(
+                            bulk_upsert_brands if self.offline else bulk_load_brands, session,
+                            brands_extracted_from_this_page)
+                    page_metrics["db_seconds"] += time.monotonic() - db_started_at
+                    page_metrics["rows_inserted"] = inserted_count
+                    if inserted_count < len(brands_extracted_from_this_page):
+                        logger_service.info(
+                            f"Trang {current_page} ngày {start_str}: {len(brands_extracted_from_this_page) - inserted_count} "
+                            f"nhãn hiệu đã được process khác thêm trước (ON CONFLICT DO NOTHING).")
+                    brands_pending_commit_count += len(brands_extracted_from_this_page)
+                    # Dù được thêm hay bị ON CONFLICT bỏ qua, các số đơn này sẽ có trong DB khi trang được commit
+                    pending_known_numbers.extend(brand.application_number for brand in brands_extracted_from_this_page)
 
                 except Exception as e_db_commit:
                     logger_service.error(
@@ -404,7 +687,17 @@ class ScraperService:
             elif page_had_new_valid_data is False and rows:
                 logger_service.info(
                     f"Trang {current_page} ngày {start_str} đã xử lý nhưng không có dữ liệu mới nào được thêm vào DB.")
-                state_save_callback(current_page)
+
+            page_metrics["rows_skipped"] = len(rows) - page_metrics.get("rows_inserted", 0)
+            pages_pending_commit.append(current_page)
+            if len(pages_pending_commit) >= pages_per_commit:
+                # Thời gian commit được tính cho trang kích hoạt commit
+                db_started_at = time.monotonic()
+                brands_committed_count += await self._commit_pages(
+                    session, pages_pending_commit, brands_pending_commit_count, start_str, on_pages_committed)
+                pages_pending_commit, brands_pending_commit_count = [], 0
+                page_metrics["db_seconds"] += time.monotonic() - db_started_at
+            self._emit_page_metrics(page_metrics_callback, page_metrics, page_started_at)
 
             if scrape_status_result["status"] not in ["request_error", "soup_error",
                                                       "db_commit_error"]:
@@ -412,25 +705,79 @@ class ScraperService:
                     scrape_status_result = {
                         "status": "processing_pages",
 
-                        "brands_processed_count": len(brands_collected_in_this_run),
+                        "brands_processed_count": brands_committed_count,
                         "message": f"Successfully processed page {current_page} for day {start_str}."
 
                     }
 
             current_page += 1
-            await asyncio.sleep(random.uniform(min_request_delay, max_request_delay))
-
-        scrape_status_result["brands_processed_count"] = len(brands_collected_in_this_run)
-        if scrape_status_result["status"] == "completed_all_pages" and len(
-                brands_collected_in_this_run) == 0 and initial_start_page == 1:
-            pass
+            if not self.offline and self.rate_limiter is None:
+                await asyncio.sleep(random.uniform(min_request_delay, max_request_delay))
+
+        scrape_status_result["brands_processed_count"] = brands_committed_count
+        if missing_archive_pages and scrape_status_result["status"] in (
+                "completed_all_pages", "no_data_on_first_page", "completed_range"):
+            # Không ghi nhận là hoàn tất: các trang thiếu phải được cào lại online
+            logger_service.warning(
+                f"[Offline] Ngày {start_date.strftime('%Y-%m-%d')} thiếu {len(missing_archive_pages)} trang trong archive: "
+                f"{missing_archive_pages}.")
+            scrape_status_result = {
+                "status": "archive_incomplete",
+                "brands_processed_count": brands_committed_count,
+                "missing_pages": missing_archive_pages,
+                "message": f"Reprocessed archived pages for day {start_date.strftime('%d.%m.%Y')}, "
+                           f"{len(missing_archive_pages)} page(s) missing from the archive."
+            }
 
         logger_service.info(
             f"Kết thúc scrape cho ngày {start_date.strftime('%Y-%m-%d')}. "
             f"Trạng thái: {scrape_status_result['status']}. "
             f"Tổng số nhãn hiệu được xử lý trong lần gọi này: {scrape_status_result['brands_processed_count']}.")
+        if self.proxy_urls:
+            logger_service.info(f"Tình trạng proxy: {self.proxy_health.snapshot()}")
         return scrape_status_result
 
+    @staticmethod
+    def _emit_page_metrics(page_metrics_callback: Optional[Callable[[Dict[str, Any]], None]],
+                           page_metrics: Dict[str, Any], page_started_at: float) -> None:
+        page_metrics["total_seconds"] = time.monotonic() - page_started_at
+        observe_page_metrics(page_metrics)
+        record_span("page", page_metrics["total_seconds"], **page_metrics)
+        if page_metrics_callback is None:
+            return
+        try:
+            page_metrics_callback(page_metrics)
+        except Exception as e_metrics:
+            # Số liệu chỉ để theo dõi, không được làm hỏng lần cào
+            logger_service.warning(f"Lỗi khi ghi số liệu trang {page_metrics.get('page')}: {e_metrics}")
+
+    async def run_db(self, func: Callable, *args):
+        # Mọi lời gọi đồng bộ chạm DB/SQLite (truy vấn, commit, checkpoint, DDL) đi qua đây: chạy trong thread khi
+        # offload_db_calls (chế độ asyncio, nhiều đơn vị việc dùng chung event loop), ngược lại gọi trực tiếp
+        if self.offload_db_calls:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _commit_pages(self, session: Session, pages: List[int], brands_count: int, day_str: str,
+                            state_save_callback: Callable[[int], None]) -> int:
+        # Commit dữ liệu trước rồi mới ghi checkpoint: nếu chết giữa hai bước thì trang chỉ bị cào lại,
+        # và ON CONFLICT DO NOTHING khiến lần ghi lại không tạo bản trùng
+        try:
+            with span("commit", day=day_str, first_page=pages[0], last_page=pages[-1]):
+                await self.run_db(session.commit)
+        except Exception as e_commit:
+            await self.run_db(session.rollback)
+            logger_service.error(
+                f"Lỗi khi commit trang {pages[0]}-{pages[-1]} ngày {day_str}: {e_commit}", exc_info=True)
+            raise CustomScrapingError(
+                message="Failed to commit data to database.",
+                page=pages[0],
+                day=day_str,
+                original_error=e_commit
+            )
+        await self.run_db(state_save_callback, pages[-1])
+        return brands_count
+
     async def check_pending_brands(self, session: Session):
         logger = logging.getLogger(f"{self.__class__.__name__}.check_pending_brands")
         logger.info("Bắt đầu kiểm tra các đơn có trạng thái 'Đang giải quyết'...")
@@ -446,7 +793,8 @@ class ScraperService:
                 )
             )
         )
-        pending_brands: List[Brand] = session.exec(statement).all()
+        with span("check_pending.query"):
+            pending_brands: List[Brand] = session.exec(statement).all()
 
         if not pending_brands:
             logger.info("✅ Không tìm thấy đơn nào có trạng thái 'Đang giải quyết' để kiểm tra.")
@@ -473,7 +821,8 @@ class ScraperService:
             url = f"https://vietnamtrademark.net/search?q={brand.application_number.strip()}"
             logger.info(f"🌍 Gọi đến VietnamTrademark: {url}") # đến đây rồi 
 
-            response = await self.make_request(url)
+            with span("check_pending.make_request", application_number=brand.application_number):
+                response = await self.make_request(url)
             if not response:
                 logger.warning(
                     f"❌ Không nhận được phản hồi từ VietnamTrademark cho số đơn {brand.application_number} (ID: {brand.id}). Bỏ qua đơn này.")
@@ -482,9 +831,9 @@ class ScraperService:
                 continue
 
             try:
-                soup = BeautifulSoup(response.text, 'html.parser')
                 target_row = None
-                rows_on_page = soup.select("table.table tbody tr")
+                with span("check_pending.parse", application_number=brand.application_number):
+                    rows_on_page = self.result_parser.parse_rows(response.text)
 
                 if not rows_on_page:
                     logger.warning(
@@ -494,8 +843,7 @@ class ScraperService:
                     continue
 
                 for r_check in rows_on_page:
-                    app_num_tag_check = r_check.select_one("td:nth-child(8) a")
-                    if app_num_tag_check and app_num_tag_check.text.strip() == brand.application_number:
+                    if r_check.application_number == brand.application_number:
                         target_row = r_check
                         break
 
@@ -507,9 +855,8 @@ class ScraperService:
                         random.uniform(min_delay_check / 2, max_delay_check / 2))
                     continue
 
-                status_tag = target_row.select_one("td.trang-thai span.badge")
-                if status_tag:
-                    new_status = status_tag.text.strip()
+                if target_row.status:
+                    new_status = target_row.status
                     logger.info(
                         f"📊 Trạng thái mới từ web cho {brand.application_number}: '{new_status}' (Trạng thái hiện tại trong DB: '{brand.status}')")
 
@@ -542,7 +889,8 @@ class ScraperService:
 
         if updated_count > 0:
             try:
-                session.commit()
+                with span("check_pending.commit", updated=updated_count):
+                    session.commit()
                 logger.info(f"💾 ĐÃ COMMIT THÀNH CÔNG: Cập nhật trạng thái cho {updated_count} đơn vào database.")
             except Exception as e_commit:
                 logger.error(f"❌ Lỗi khi commit các thay đổi trạng thái vào database: {e_commit}", exc_info=True)
@@ -1,24 +1,43 @@
 import sqlite3
 import os
+import time
+import atexit
 import logging
 from datetime import date, datetime
-from typing import Dict, Optional,List
+from typing import Any, Dict, Optional,List,Tuple
 
-_connection = None
+# Mỗi process (kể cả worker fork từ manager) mở kết nối riêng; không dùng lại kết nối kế thừa từ process cha
+_connections: Dict[Tuple[int, str], sqlite3.Connection] = {}
+# Checkpoint trang chờ ghi theo db_path: {date_range_key: (last_completed_page, updated_at)}
+_pending_page_states: Dict[str, Dict[str, Tuple[int, str]]] = {}
+_pending_save_counts: Dict[str, int] = {}
+_last_flush_at: Dict[str, float] = {}
+# Số liệu hiệu năng từng trang chờ ghi theo db_path, ghi cùng lượt với checkpoint
+_pending_page_metrics: Dict[str, List[Tuple]] = {}
+
+PAGE_METRIC_COLUMNS = ("day", "page", "source", "recorded_at", "html_bytes", "fetch_seconds", "retries", "parse_seconds",
+                       "rows_parsed", "db_seconds", "images_fetched", "image_seconds", "rows_inserted", "rows_skipped",
+                       "total_seconds")
 
 def get_db_path(project_root: str) -> str:
     return os.path.join(project_root, "scraper_state.sqlite3")
 
 def get_connection(db_path: str):
-    global _connection
-    if _connection is None:
+    connection_key = (os.getpid(), db_path)
+    connection = _connections.get(connection_key)
+    if connection is None:
         try:
-            _connection = sqlite3.connect(db_path, timeout=30.0)
+            # check_same_thread=False: chế độ asyncio gọi các hàm ghi trạng thái qua asyncio.to_thread
+            connection = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False)
+            # WAL: dashboard/router đọc không chặn worker ghi; synchronous=NORMAL bỏ fsync ở mỗi commit
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            _connections[connection_key] = connection
             logging.info(f"Đã kết nối đến state database: {db_path}")
         except sqlite3.Error as e:
             logging.critical(f"Không thể kết nối đến state database {db_path}: {e}", exc_info=True)
             raise
-    return _connection
+    return connection
 
 def init_db(db_path: str):
     try:
@@ -38,26 +57,100 @@ def init_db(db_path: str):
                 updated_at TEXT NOT NULL
             )
         ''')
+        # Một dòng cho mỗi (ngày, trang, nguồn): cào lại trang thì ghi đè số liệu của lần trước
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS page_metrics (
+                day TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                recorded_at TEXT NOT NULL,
+                html_bytes INTEGER NOT NULL DEFAULT 0,
+                fetch_seconds REAL NOT NULL DEFAULT 0,
+                retries INTEGER NOT NULL DEFAULT 0,
+                parse_seconds REAL NOT NULL DEFAULT 0,
+                rows_parsed INTEGER NOT NULL DEFAULT 0,
+                db_seconds REAL NOT NULL DEFAULT 0,
+                images_fetched INTEGER NOT NULL DEFAULT 0,
+                image_seconds REAL NOT NULL DEFAULT 0,
+                rows_inserted INTEGER NOT NULL DEFAULT 0,
+                rows_skipped INTEGER NOT NULL DEFAULT 0,
+                total_seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, page, source)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_metrics_recorded_at ON page_metrics (recorded_at)")
         conn.commit()
         logging.info("State database đã được kiểm tra và khởi tạo (nếu cần).")
     except sqlite3.Error as e:
         logging.error(f"Lỗi khi khởi tạo state database: {e}", exc_info=True)
         conn.rollback()
 
-def save_page_state(db_path: str, date_range_key: str, last_completed_page: int):
+def save_page_state(db_path: str, date_range_key: str, last_completed_page: int, flush_interval_seconds: float = 5.0,
+                    max_pending_pages: int = 20):
+    # Gom checkpoint trong bộ nhớ, chỉ ghi xuống SQLite sau flush_interval_seconds hoặc max_pending_pages lần lưu.
+    # Nếu process chết giữa hai lần ghi thì chỉ các trang đã commit gần nhất bị cào lại (ON CONFLICT bỏ qua bản trùng)
+    pending = _pending_page_states.setdefault(db_path, {})
+    pending[date_range_key] = (last_completed_page, datetime.now().isoformat())
+    _pending_save_counts[db_path] = _pending_save_counts.get(db_path, 0) + 1
+    if (time.monotonic() - _last_flush_at.get(db_path, 0.0) >= flush_interval_seconds
+            or _pending_save_counts[db_path] >= max_pending_pages):
+        flush_page_states(db_path)
+
+def record_page_metrics(db_path: str, metrics: Dict[str, Any]):
+    # Chỉ đưa vào bộ đệm; được ghi ở lần flush_page_states kế tiếp
+    row = dict(metrics, recorded_at=metrics.get("recorded_at") or datetime.now().isoformat())
+    _pending_page_metrics.setdefault(db_path, []).append(tuple(row.get(column, 0) for column in PAGE_METRIC_COLUMNS))
+
+def flush_page_metrics(db_path: str):
+    # Lấy hẳn bộ đệm ra trước khi ghi: ở chế độ asyncio hàm này chạy trong thread trong khi các coroutine khác
+    # vẫn tiếp tục thêm vào bộ đệm mới
+    pending = _pending_page_metrics.pop(db_path, None)
+    if not pending:
+        return
     try:
         conn = get_connection(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO page_metrics ({', '.join(PAGE_METRIC_COLUMNS)})
+            VALUES ({', '.join('?' for _ in PAGE_METRIC_COLUMNS)})
+        ''', pending)
+        conn.commit()
+        logging.debug(f"[SQLite] Đã lưu số liệu của {len(pending)} trang.")
+    except sqlite3.Error as e:
+        logging.error(f"[SQLite] Lỗi khi lưu page_metrics: {e}", exc_info=True)
+        _pending_page_metrics.setdefault(db_path, [])[:0] = pending
+
+def flush_page_states(db_path: str):
+    flush_page_metrics(db_path)
+    pending = _pending_page_states.pop(db_path, None)
+    _last_flush_at[db_path] = time.monotonic()
+    if not pending:
+        return
+    _pending_save_counts[db_path] = 0
+    try:
+        conn = get_connection(db_path)
+        conn.executemany('''
             INSERT OR REPLACE INTO page_state (date_range_key, last_completed_page, updated_at)
             VALUES (?, ?, ?)
-        ''', (date_range_key, last_completed_page, datetime.now().isoformat()))
+        ''', [(date_range_key, page, updated_at) for date_range_key, (page, updated_at) in pending.items()])
         conn.commit()
-        logging.info(f"[SQLite] Đã lưu trạng thái: Key '{date_range_key}', Page: {last_completed_page}")
+        logging.info(f"[SQLite] Đã lưu trạng thái: {', '.join(f'{key} -> trang {page}' for key, (page, _) in pending.items())}")
     except sqlite3.Error as e:
-        logging.error(f"[SQLite] Lỗi khi lưu page_state cho key '{date_range_key}': {e}", exc_info=True)
+        logging.error(f"[SQLite] Lỗi khi lưu page_state: {e}", exc_info=True)
+        # Trả lại bộ đệm để lần flush sau ghi tiếp; checkpoint mới hơn được lưu trong lúc ghi thì giữ bản mới
+        current = _pending_page_states.setdefault(db_path, {})
+        for date_range_key, value in pending.items():
+            current.setdefault(date_range_key, value)
+
+def flush_all_page_states():
+    for db_path in set(_pending_page_states) | set(_pending_page_metrics):
+        flush_page_states(db_path)
+
+atexit.register(flush_all_page_states)
 
 def load_scrape_state(db_path: str, date_range_key: str, default_page: int = 1) -> int:
+    pending = _pending_page_states.get(db_path, {}).get(date_range_key)
+    if pending:
+        return pending[0] + 1
     try:
         conn = get_connection(db_path)
         cursor = conn.cursor()
@@ -77,10 +170,15 @@ def load_scrape_state(db_path: str, date_range_key: str, default_page: int = 1)
 
 def clear_page_state_for_day(db_path: str, day_to_clear: date):
     day_key_to_clear = f"brands_{day_to_clear.strftime('%Y-%m-%d')}_{day_to_clear.strftime('%Y-%m-%d')}"
+    pending = _pending_page_states.get(db_path, {})
+    for pending_key in [key for key in pending if key == day_key_to_clear or key.startswith(f"{day_key_to_clear}_p")]:
+        del pending[pending_key]
     try:
         conn = get_connection(db_path)
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM page_state WHERE date_range_key = ?", (day_key_to_clear,))
+        # Xóa cả key của ngày và key của các khoảng trang (brands_<ngày>_<ngày>_p<a>-<b>)
+        cursor.execute("DELETE FROM page_state WHERE date_range_key = ? OR date_range_key LIKE ?",
+                       (day_key_to_clear, f"{day_key_to_clear}_p%"))
         conn.commit()
         if cursor.rowcount > 0:
             logging.info(f"[SQLite] Đã xóa trạng thái trang cho ngày: {day_to_clear.strftime('%Y-%m-%d')}")
@@ -132,7 +230,8 @@ def get_all_in_progress_days(db_path: str) -> List[date]:
             try:
                 day_str = row[0].split('_')[1]
                 d = datetime.strptime(day_str, "%Y-%m-%d").date()
-                dates.append(d)
+                if d not in dates:
+                    dates.append(d)
             except (IndexError, ValueError):
                 logging.warning(f"[SQLite] Bỏ qua key có định dạng không hợp lệ: {row[0]}")
                 continue
@@ -144,3 +243,84 @@ def get_all_in_progress_days(db_path: str) -> List[date]:
     except sqlite3.Error as e:
         logging.error(f"[SQLite] Lỗi khi lấy danh sách các ngày đang xử lý dở: {e}", exc_info=True)
         return []
+
+def _page_metrics_filter(start_day: Optional[date], end_day: Optional[date], source: Optional[str]) -> Tuple[str, list]:
+    conditions, params = [], []
+    if start_day is not None:
+        conditions.append("day >= ?")
+        params.append(start_day.strftime("%Y-%m-%d"))
+    if end_day is not None:
+        conditions.append("day <= ?")
+        params.append(end_day.strftime("%Y-%m-%d"))
+    if source is not None:
+        conditions.append("source = ?")
+        params.append(source)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+def _query_dicts(db_path: str, query: str, params: list) -> List[Dict[str, Any]]:
+    conn = get_connection(db_path)
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def get_day_performance(db_path: str, start_day: Optional[date] = None, end_day: Optional[date] = None,
+                        source: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    # Tổng hợp theo ngày, ngày tốn thời gian nhất lên đầu
+    where_clause, params = _page_metrics_filter(start_day, end_day, source)
+    try:
+        return _query_dicts(db_path, f'''
+            SELECT day, COUNT(*) AS pages, SUM(html_bytes) AS html_bytes, SUM(rows_parsed) AS rows_parsed,
+                   SUM(rows_inserted) AS rows_inserted, SUM(rows_skipped) AS rows_skipped,
+                   SUM(images_fetched) AS images_fetched, SUM(retries) AS retries,
+                   ROUND(SUM(fetch_seconds), 3) AS fetch_seconds, ROUND(SUM(parse_seconds), 3) AS parse_seconds,
+                   ROUND(SUM(db_seconds), 3) AS db_seconds, ROUND(SUM(image_seconds), 3) AS image_seconds,
+                   ROUND(SUM(total_seconds), 3) AS total_seconds, ROUND(AVG(total_seconds), 3) AS avg_page_seconds,
+                   MIN(recorded_at) AS first_recorded_at, MAX(recorded_at) AS last_recorded_at
+            FROM page_metrics {where_clause}
+            GROUP BY day
+            ORDER BY total_seconds DESC
+            LIMIT ?
+        ''', params + [limit])
+    except sqlite3.Error as e:
+        logging.error(f"[SQLite] Lỗi khi tổng hợp page_metrics theo ngày: {e}", exc_info=True)
+        return []
+
+def get_stage_breakdown(db_path: str, start_day: Optional[date] = None, end_day: Optional[date] = None,
+                        source: Optional[str] = None) -> Dict[str, Any]:
+    # Thời gian mỗi giai đoạn (tải trang, parse, DB, ảnh) trên tổng thời gian xử lý trang: giai đoạn chiếm phần lớn
+    # là nút thắt; nếu tải trang chiếm gần hết thì tăng CONCURRENT_SCRAPING_TASKS mới có tác dụng
+    where_clause, params = _page_metrics_filter(start_day, end_day, source)
+    try:
+        rows = _query_dicts(db_path, f'''
+            SELECT COUNT(*) AS pages, COUNT(DISTINCT day) AS days, COALESCE(SUM(html_bytes), 0) AS html_bytes,
+                   COALESCE(SUM(rows_inserted), 0) AS rows_inserted, COALESCE(SUM(rows_skipped), 0) AS rows_skipped,
+                   COALESCE(SUM(retries), 0) AS retries, COALESCE(SUM(fetch_seconds), 0) AS fetch_seconds,
+                   COALESCE(SUM(parse_seconds), 0) AS parse_seconds, COALESCE(SUM(db_seconds), 0) AS db_seconds,
+                   COALESCE(SUM(image_seconds), 0) AS image_seconds, COALESCE(SUM(total_seconds), 0) AS total_seconds,
+                   COALESCE(MAX(fetch_seconds), 0) AS max_fetch_seconds, COALESCE(MAX(total_seconds), 0) AS max_page_seconds
+            FROM page_metrics {where_clause}
+        ''', params)
+    except sqlite3.Error as e:
+        logging.error(f"[SQLite] Lỗi khi tổng hợp page_metrics theo giai đoạn: {e}", exc_info=True)
+        return {}
+    summary = rows[0]
+    pages = summary["pages"] or 0
+    total_seconds = summary["total_seconds"] or 0.0
+    for stage in ("fetch", "parse", "db", "image"):
+        stage_seconds = summary[f"{stage}_seconds"]
+        summary[f"{stage}_seconds"] = round(stage_seconds, 3)
+        summary[f"avg_{stage}_seconds"] = round(stage_seconds / pages, 4) if pages else 0.0
+        summary[f"{stage}_share"] = round(stage_seconds / total_seconds, 3) if total_seconds else 0.0
+    summary["total_seconds"] = round(total_seconds, 3)
+    summary["avg_page_seconds"] = round(total_seconds / pages, 4) if pages else 0.0
+    return summary
+
+def get_slowest_pages(db_path: str, start_day: Optional[date] = None, end_day: Optional[date] = None,
+                      source: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    where_clause, params = _page_metrics_filter(start_day, end_day, source)
+    try:
+        return _query_dicts(db_path, f"SELECT * FROM page_metrics {where_clause} ORDER BY total_seconds DESC LIMIT ?",
+                            params + [limit])
+    except sqlite3.Error as e:
+        logging.error(f"[SQLite] Lỗi khi lấy các trang chậm nhất: {e}", exc_info=True)
+        return []
@@ -0,0 +1,176 @@
+import os
+import sys
+import glob
+import json
+import time
+import atexit
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from src.tools.config import settings
+
+logger_tracing = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TRACE_DIR = settings.TRACE_DIR or os.path.join(PROJECT_ROOT, "traces")
+
+
+def _now_us() -> int:
+    # Dùng đồng hồ thực để gộp được span của nhiều process trên cùng một trục thời gian
+    return time.time_ns() // 1000
+
+
+class _NoopSpan:
+    # Trả về khi tracing tắt: không đo thời gian, không cấp phát gì thêm
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "tid", "started_us")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.tid = self.tracer.current_tid()
+        self.started_us = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add_complete_event(self.name, self.started_us, _now_us() - self.started_us, self.tid, self.args)
+        return False
+
+
+class Tracer:
+    # Gom span của một process thành event "X" (complete) theo định dạng Chrome trace, ghi nối thêm vào
+    # trace_dir/trace-<pid>.jsonl. Mỗi asyncio task là một track riêng để các coroutine chạy xen kẽ không chồng lên nhau.
+    def __init__(self, trace_dir: str, flush_every: int = 1000):
+        self.pid = os.getpid()
+        self.path = os.path.join(trace_dir, f"trace-{self.pid}.jsonl")
+        self.flush_every = max(flush_every, 1)
+        self._events: List[Dict[str, Any]] = []
+        self._named_tids = set()
+        self._lock = threading.Lock()
+        os.makedirs(trace_dir, exist_ok=True)
+        self._events.append({"ph": "M", "name": "process_name", "pid": self.pid, "tid": 0,
+                             "args": {"name": f"scraper-{self.pid}"}})
+
+    def current_tid(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        tid = id(task) if task is not None else threading.get_ident()
+        if tid not in self._named_tids:
+            self._named_tids.add(tid)
+            track_name = task.get_name() if task is not None else threading.current_thread().name
+            self._append({"ph": "M", "name": "thread_name", "pid": self.pid, "tid": tid, "args": {"name": track_name}})
+        return tid
+
+    def add_complete_event(self, name: str, started_us: int, duration_us: int, tid: int, args: Dict[str, Any]) -> None:
+        self._append({"ph": "X", "name": name, "cat": "scrape", "ts": started_us, "dur": duration_us,
+                      "pid": self.pid, "tid": tid, "args": args})
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self._events.append(event)
+            should_flush = len(self._events) >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events))
+        except OSError as e:
+            logger_tracing.error(f"[Trace] Không thể ghi {self.path}: {e}. Bỏ {len(events)} event.")
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    # Tạo lười theo pid: process fork từ manager không ghi lại buffer kế thừa từ process cha
+    global _tracer
+    if not settings.TRACE_ENABLED:
+        return None
+    if _tracer is None or _tracer.pid != os.getpid():
+        _tracer = Tracer(TRACE_DIR, settings.TRACE_FLUSH_EVENTS)
+    return _tracer
+
+
+def span(name: str, **args):
+    """Đo một giai đoạn: ``with span("parse", page=3): ...``. Khi TRACE_ENABLED=false chỉ trả về một đối tượng rỗng."""
+    if not settings.TRACE_ENABLED:
+        return _NOOP_SPAN
+    return _Span(get_tracer(), name, args)
+
+
+def record_span(name: str, duration_seconds: float, **args) -> None:
+    # Ghi một span đã kết thúc (vd. cả một trang, có nhiều nhánh thoát) từ thời lượng đo sẵn
+    tracer = get_tracer()
+    if tracer is None:
+        return
+    duration_us = int(duration_seconds * 1_000_000)
+    tracer.add_complete_event(name, _now_us() - duration_us, duration_us, tracer.current_tid(), args)
+
+
+def flush_trace() -> None:
+    if _tracer is not None and _tracer.pid == os.getpid():
+        _tracer.flush()
+
+
+atexit.register(flush_trace)
+
+
+def reset_trace_dir() -> None:
+    # Gọi một lần khi manager khởi động: các file .jsonl chỉ chứa span của lần chạy hiện tại
+    if not settings.TRACE_ENABLED:
+        return
+    for path in glob.glob(os.path.join(TRACE_DIR, "trace-*.jsonl")):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger_tracing.warning(f"[Trace] Không thể xóa file trace cũ {path}: {e}")
+
+
+def export_chrome_trace(output_path: Optional[str] = None, trace_dir: Optional[str] = None) -> Optional[str]:
+    """Gộp trace-<pid>.jsonl của mọi process thành một file Chrome trace JSON (mở bằng chrome://tracing hoặc Perfetto)."""
+    trace_dir = trace_dir or TRACE_DIR
+    flush_trace()
+    events = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "trace-*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger_tracing.warning(f"[Trace] Bỏ qua dòng hỏng {line_number} trong {path}.")
+    if not events:
+        return None
+    output_path = output_path or os.path.join(trace_dir, f"trace-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    logger_tracing.info(f"[Trace] Đã ghi {len(events)} event vào {output_path}.")
+    return output_path
+
+
+if __name__ == '__main__':
+    # python -m src.tools.tracing [output.json]: gộp lại các file trace sau khi chạy
+    print(export_chrome_trace(sys.argv[1] if len(sys.argv) > 1 else None) or "Không có span nào trong thư mục trace.")
@@ -52,6 +52,8 @@ async def main_update_statuses():
             await scraper.check_pending_brands(session)
     except Exception as e_main:
         logger.error(f"❌ Lỗi nghiêm trọng trong quy trình chính (main_update_statuses): {e_main}", exc_info=True)
+    finally:
+        await scraper.close()
 
     logger.info("🏁 Kết thúc quy trình cập nhật trạng thái đơn theo lịch.")
 
@@ -0,0 +1,315 @@
+import os
+import socket
+import logging
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional
+from sqlalchemy import text, Engine
+from src.tools.state_manager import get_connection, load_control_state, save_control_state
+
+logger_queue = logging.getLogger(__name__)
+
+UNIT_PENDING = "pending"
+UNIT_RUNNING = "running"
+UNIT_DONE = "done"
+UNIT_FAILED = "failed"
+
+
+class WorkUnit(NamedTuple):
+    # Một đơn vị việc: các trang [start_page, end_page] của một ngày; end_page None = cào tới trang rỗng đầu tiên
+    day: date
+    start_page: int = 1
+    end_page: Optional[int] = None
+
+    @property
+    def is_whole_day(self) -> bool:
+        return self.start_page == 1 and self.end_page is None
+
+    @property
+    def state_key(self) -> str:
+        # Cả ngày giữ key cũ để tương thích với page_state đã lưu trước đây
+        day_str = self.day.strftime('%Y-%m-%d')
+        base_key = f"brands_{day_str}_{day_str}"
+        if self.is_whole_day:
+            return base_key
+        return f"{base_key}_p{self.start_page}-{self.end_page if self.end_page is not None else ''}"
+
+    def label(self) -> str:
+        if self.is_whole_day:
+            return self.day.strftime('%Y-%m-%d')
+        return f"{self.day.strftime('%Y-%m-%d')} [trang {self.start_page}-{self.end_page if self.end_page is not None else 'hết'}]"
+
+
+def split_page_range(day: date, first_page: int, last_page: int, pages_per_unit: int) -> List[WorkUnit]:
+    # Chia [first_page, last_page] thành các khoảng pages_per_unit trang; khoảng cuối để mở (end_page None)
+    # để không bỏ sót nếu ngày có nhiều trang hơn phân trang cho thấy
+    units = []
+    start_page = first_page
+    while start_page <= last_page:
+        end_page = start_page + pages_per_unit - 1
+        units.append(WorkUnit(day, start_page, end_page if end_page < last_page else None))
+        start_page = end_page + 1
+    return units
+
+
+class LocalWorkQueue:
+    # Hàng đợi đơn vị việc lưu trong state database (SQLite) để chia nhỏ một ngày cho nhiều worker và resume theo khoảng
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        conn = get_connection(db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_unit (
+                unit_key TEXT PRIMARY KEY,
+                day TEXT NOT NULL,
+                start_page INTEGER NOT NULL,
+                end_page INTEGER,
+                status TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_work_unit_status_day ON work_unit (status, day, start_page)")
+        conn.commit()
+
+    @staticmethod
+    def _row_to_unit(row) -> WorkUnit:
+        return WorkUnit(datetime.strptime(row[0], "%Y-%m-%d").date(), row[1], row[2])
+
+    def _set_status(self, unit: WorkUnit, status: str) -> None:
+        conn = get_connection(self.db_path)
+        conn.execute("UPDATE work_unit SET status = ?, updated_at = ? WHERE unit_key = ?",
+                     (status, datetime.now().isoformat(), unit.state_key))
+        conn.commit()
+
+    def put_many(self, units: List[WorkUnit]) -> None:
+        # Đơn vị đã có (kể cả đã xong) thì giữ nguyên
+        conn = get_connection(self.db_path)
+        now = datetime.now().isoformat()
+        conn.executemany('''
+            INSERT OR IGNORE INTO work_unit (unit_key, day, start_page, end_page, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(unit.state_key, unit.day.strftime('%Y-%m-%d'), unit.start_page, unit.end_page, UNIT_PENDING, now)
+              for unit in units])
+        conn.commit()
+
+    def claim(self) -> Optional[WorkUnit]:
+        conn = get_connection(self.db_path)
+        row = conn.execute('''
+            SELECT day, start_page, end_page FROM work_unit
+            WHERE status = ? ORDER BY day, start_page LIMIT 1
+        ''', (UNIT_PENDING,)).fetchone()
+        if row is None:
+            return None
+        unit = self._row_to_unit(row)
+        self._set_status(unit, UNIT_RUNNING)
+        return unit
+
+    def complete(self, unit: WorkUnit) -> None:
+        self._set_status(unit, UNIT_DONE)
+
+    def release(self, unit: WorkUnit) -> None:
+        # Đơn vị bị dừng giữa chừng (hết phiên/SIGTERM): trả về hàng đợi, tiếp tục từ checkpoint
+        self._set_status(unit, UNIT_PENDING)
+
+    def fail(self, unit: WorkUnit) -> None:
+        # Đơn vị lỗi/chưa xong chỉ được chạy lại ở phiên sau (requeue_unfinished), tránh vòng lặp crash liên tục
+        self._set_status(unit, UNIT_FAILED)
+
+    def requeue_unfinished(self) -> int:
+        conn = get_connection(self.db_path)
+        cursor = conn.execute("UPDATE work_unit SET status = ?, updated_at = ? WHERE status IN (?, ?)",
+                              (UNIT_PENDING, datetime.now().isoformat(), UNIT_RUNNING, UNIT_FAILED))
+        conn.commit()
+        if cursor.rowcount:
+            logger_queue.info(f"[WorkQueue] Đưa {cursor.rowcount} đơn vị việc dở dang về hàng đợi.")
+        return cursor.rowcount
+
+    def renew(self, units: List[WorkUnit]) -> None:
+        # Hàng đợi cục bộ không có lease
+        return None
+
+    def has_day(self, day: date) -> bool:
+        conn = get_connection(self.db_path)
+        return conn.execute("SELECT 1 FROM work_unit WHERE day = ? LIMIT 1",
+                            (day.strftime('%Y-%m-%d'),)).fetchone() is not None
+
+    def day_has_open_units(self, day: date) -> bool:
+        conn = get_connection(self.db_path)
+        return conn.execute("SELECT 1 FROM work_unit WHERE day = ? AND status != ? LIMIT 1",
+                            (day.strftime('%Y-%m-%d'), UNIT_DONE)).fetchone() is not None
+
+    def has_pending(self) -> bool:
+        conn = get_connection(self.db_path)
+        return conn.execute("SELECT 1 FROM work_unit WHERE status = ? LIMIT 1", (UNIT_PENDING,)).fetchone() is not None
+
+    def earliest_open_day(self) -> Optional[date]:
+        conn = get_connection(self.db_path)
+        row = conn.execute("SELECT MIN(day) FROM work_unit WHERE status != ?", (UNIT_DONE,)).fetchone()
+        return datetime.strptime(row[0], "%Y-%m-%d").date() if row and row[0] else None
+
+    def latest_done_day(self) -> Optional[date]:
+        conn = get_connection(self.db_path)
+        row = conn.execute("SELECT MAX(day) FROM work_unit WHERE status = ?", (UNIT_DONE,)).fetchone()
+        return datetime.strptime(row[0], "%Y-%m-%d").date() if row and row[0] else None
+
+    def advance_completed_watermark(self) -> Optional[date]:
+        # last_fully_completed_day (control_state cùng state database) chỉ tiến lên, tới ngày ngay trước ngày sớm nhất
+        # còn đơn vị chưa xong (hoặc ngày xong muộn nhất nếu không còn gì dở). Một ngày lớn đã chia trang xong sau
+        # các ngày sau nó không kéo mốc lùi lại. Trả về mốc mới, None nếu mốc không đổi.
+        earliest_open_day = self.earliest_open_day()
+        candidate_day = earliest_open_day - timedelta(days=1) if earliest_open_day else self.latest_done_day()
+        # Mốc phải là một ngày đã thực sự xong trong hàng đợi (không phải ngày trước ngày bắt đầu kế hoạch)
+        if candidate_day is None or not self.has_day(candidate_day) or self.day_has_open_units(candidate_day):
+            return None
+        last_completed_str = load_control_state(self.db_path).get("last_fully_completed_day")
+        if last_completed_str and candidate_day <= datetime.strptime(last_completed_str, "%Y-%m-%d").date():
+            return None
+        save_control_state(self.db_path, candidate_day)
+        self.clear_done_through(candidate_day)
+        return candidate_day
+
+    def clear_done_through(self, day: date) -> None:
+        # Chỉ xóa đơn vị đã xong của các ngày tới mốc hoàn thành; ngày đã xong nhưng nằm sau mốc vẫn được giữ
+        # để next_unqueued_day không gieo lại
+        try:
+            conn = get_connection(self.db_path)
+            conn.execute("DELETE FROM work_unit WHERE day <= ? AND status = ?", (day.strftime('%Y-%m-%d'), UNIT_DONE))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger_queue.error(f"[WorkQueue] Lỗi khi xóa đơn vị việc đã xong tới ngày {day.strftime('%Y-%m-%d')}: {e}",
+                               exc_info=True)
+
+
+class PostgresWorkQueue:
+    # Hàng đợi dùng chung trong PostgreSQL cho nhiều run_scraper.py trên nhiều máy: claim bằng FOR UPDATE SKIP LOCKED,
+    # mỗi đơn vị có lease hết hạn (máy chết thì đơn vị được máy khác nhận lại) và checkpoint trang đã xong
+    def __init__(self, engine: Engine, owner: Optional[str] = None, lease_seconds: float = 900):
+        self.engine = engine
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+
+    def ensure_schema(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS scrape_work_unit (
+                    unit_key text PRIMARY KEY,
+                    day date NOT NULL,
+                    start_page integer NOT NULL,
+                    end_page integer,
+                    status text NOT NULL,
+                    lease_owner text,
+                    lease_expires_at timestamptz,
+                    last_completed_page integer,
+                    updated_at timestamptz NOT NULL DEFAULT now()
+                );
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_scrape_work_unit_status_day
+                ON scrape_work_unit (status, day, start_page);
+            """))
+
+    def _set_status(self, unit: WorkUnit, status: str) -> None:
+        # Chỉ chủ lease hiện tại mới đổi được trạng thái (lease đã hết hạn và bị máy khác nhận thì bỏ qua)
+        with self.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE scrape_work_unit
+                SET status = :status, lease_owner = NULL, lease_expires_at = NULL, updated_at = now()
+                WHERE unit_key = :unit_key AND lease_owner = :owner
+            """), {"status": status, "unit_key": unit.state_key, "owner": self.owner})
+        if result.rowcount == 0:
+            logger_queue.warning(f"[WorkQueue] {unit.label()} không còn thuộc lease của {self.owner}. Bỏ qua cập nhật '{status}'.")
+
+    def put_many(self, units: List[WorkUnit]) -> None:
+        if not units:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO scrape_work_unit (unit_key, day, start_page, end_page, status)
+                VALUES (:unit_key, :day, :start_page, :end_page, :status)
+                ON CONFLICT (unit_key) DO NOTHING
+            """), [{"unit_key": unit.state_key, "day": unit.day, "start_page": unit.start_page,
+                    "end_page": unit.end_page, "status": UNIT_PENDING} for unit in units])
+
+    def claim(self) -> Optional[WorkUnit]:
+        with self.engine.begin() as conn:
+            row = conn.execute(text("""
+                UPDATE scrape_work_unit
+                SET status = :running, lease_owner = :owner,
+                    lease_expires_at = now() + make_interval(secs => :lease_seconds), updated_at = now()
+                WHERE unit_key = (
+                    SELECT unit_key FROM scrape_work_unit
+                    WHERE status = :pending OR (status = :running AND lease_expires_at < now())
+                    ORDER BY day, start_page
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING day, start_page, end_page
+            """), {"running": UNIT_RUNNING, "pending": UNIT_PENDING, "owner": self.owner,
+                   "lease_seconds": self.lease_seconds}).fetchone()
+        if row is None:
+            return None
+        return WorkUnit(row[0], row[1], row[2])
+
+    def complete(self, unit: WorkUnit) -> None:
+        self._set_status(unit, UNIT_DONE)
+
+    def release(self, unit: WorkUnit) -> None:
+        self._set_status(unit, UNIT_PENDING)
+
+    def fail(self, unit: WorkUnit) -> None:
+        self._set_status(unit, UNIT_FAILED)
+
+    def renew(self, units: List[WorkUnit]) -> None:
+        if not units:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE scrape_work_unit
+                SET lease_expires_at = now() + make_interval(secs => :lease_seconds), updated_at = now()
+                WHERE unit_key = ANY(:unit_keys) AND lease_owner = :owner
+            """), {"lease_seconds": self.lease_seconds, "unit_keys": [unit.state_key for unit in units],
+                   "owner": self.owner})
+
+    def requeue_unfinished(self) -> int:
+        # Chỉ đơn vị lỗi; đơn vị đang chạy thuộc máy khác được giữ nguyên, hết lease thì claim tự nhận lại
+        with self.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE scrape_work_unit SET status = :pending, updated_at = now() WHERE status = :failed
+            """), {"pending": UNIT_PENDING, "failed": UNIT_FAILED})
+        if result.rowcount:
+            logger_queue.info(f"[WorkQueue] Đưa {result.rowcount} đơn vị việc lỗi về hàng đợi chung.")
+        return result.rowcount
+
+    def has_day(self, day: date) -> bool:
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT 1 FROM scrape_work_unit WHERE day = :day LIMIT 1"),
+                                {"day": day}).fetchone() is not None
+
+    def day_has_open_units(self, day: date) -> bool:
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT 1 FROM scrape_work_unit WHERE day = :day AND status != :done LIMIT 1"),
+                                {"day": day, "done": UNIT_DONE}).fetchone() is not None
+
+    def has_pending(self) -> bool:
+        with self.engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT 1 FROM scrape_work_unit
+                WHERE status = :pending OR (status = :running AND lease_expires_at < now()) LIMIT 1
+            """), {"pending": UNIT_PENDING, "running": UNIT_RUNNING}).fetchone() is not None
+
+    def load_checkpoint(self, unit: WorkUnit) -> Optional[int]:
+        with self.engine.connect() as conn:
+            row = conn.execute(text("SELECT last_completed_page FROM scrape_work_unit WHERE unit_key = :unit_key"),
+                               {"unit_key": unit.state_key}).fetchone()
+        return row[0] if row else None
+
+    def save_checkpoint(self, unit: WorkUnit, page: int) -> None:
+        # Như _set_status: máy có lease đã hết hạn (đơn vị đang được máy khác cào lại) không được đẩy checkpoint
+        with self.engine.begin() as conn:
+            result = conn.execute(text("""
+                UPDATE scrape_work_unit
+                SET last_completed_page = GREATEST(COALESCE(last_completed_page, 0), :page), updated_at = now()
+                WHERE unit_key = :unit_key AND lease_owner = :owner
+            """), {"page": page, "unit_key": unit.state_key, "owner": self.owner})
+        if result.rowcount == 0:
+            logger_queue.warning(
+                f"[WorkQueue] {unit.label()} không còn thuộc lease của {self.owner}. Bỏ qua checkpoint trang {page}.")
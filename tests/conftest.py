@@ -0,0 +1,15 @@
+import os
+
+# config.py đọc các biến bắt buộc ngay khi import; giá trị mặc định để chạy test không cần file .env
+TEST_ENV_DEFAULTS = {
+    "INITIAL_SCRAPE_START_YEAR": "2020", "INITIAL_SCRAPE_START_MOTH": "1", "INITIAL_SCRAPE_START_DAY": "1",
+    "LOCAL_MEDIA_BASE_URL": "http://localhost:8000/media", "SOURCE_WEBSITE_DOMAIN": "https://vietnamtrademark.net",
+    "MAX_REQUEST_RETRIES": "3", "REQUEST_TIMEOUT": "10", "DOWNLOAD_TIMEOUT": "10", "REQUEST_INTERVAL_SECONDS": "10",
+    "SSL_VERIFY_REQUEST": "true", "SSL_VERIFY_DOWNLOAD": "true", "REQUEST_LIMIT_PER_INTERVAL": "10",
+    "MIN_REQUEST_DELAY": "1", "MAX_REQUEST_DELAY": "2", "MIN_DELAY_CHECK_PENDING": "1", "MAX_DELAY_CHECK_PENDING": "2",
+    "RUN_DURATION_MINUTES": "1", "PAUSE_DURATION_MINUTES": "1", "CONCURRENT_SCRAPING_TASKS": "1",
+    "PROXY_LOGIN": "", "PROXY_PASSWORD": "", "BOT_TOKEN": "", "CHAT_ID": "", "PROXY_IP_HTTP": "", "PROXY_PORT_HTTP": "0",
+    "PROXY_URL": "",
+}
+for key, value in TEST_ENV_DEFAULTS.items():
+    os.environ.setdefault(key, value)
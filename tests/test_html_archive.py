@@ -0,0 +1,41 @@
+import os
+import gzip
+import json
+from datetime import date
+from src.tools.html_archive import HtmlArchive
+
+DAY = date(2020, 2, 1)
+
+
+def member(page: int) -> bytes:
+    record = {"day": DAY.strftime("%Y-%m-%d"), "page": page, "url": f"/search?p={page}", "html": f"<p>{page}</p>"}
+    return gzip.compress((json.dumps(record) + "\n").encode("utf-8"))
+
+
+def write_day(archive: HtmlArchive, payload: bytes) -> None:
+    path = archive.day_path(DAY)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(payload)
+
+
+def test_load_day_reads_appended_pages(tmp_path):
+    archive = HtmlArchive(str(tmp_path))
+    for page in (1, 2, 2):
+        archive.append_page(DAY, page, f"/search?p={page}", f"<p>{page}</p>")
+    assert archive.load_day(DAY) == {1: "<p>1</p>", 2: "<p>2</p>"}
+    assert archive.load_day(date(2020, 2, 2)) == {}
+
+
+def test_load_day_skips_corrupt_member(tmp_path):
+    archive = HtmlArchive(str(tmp_path))
+    corrupt = bytearray(member(2))
+    corrupt[-8] ^= 0xFF  # sai CRC32 của member trang 2
+    write_day(archive, member(1) + bytes(corrupt) + b"garbage" + member(3) + member(4))
+    assert archive.load_day(DAY) == {1: "<p>1</p>", 3: "<p>3</p>", 4: "<p>4</p>"}
+
+
+def test_load_day_keeps_pages_before_truncated_member(tmp_path):
+    archive = HtmlArchive(str(tmp_path))
+    write_day(archive, member(1) + member(2) + member(3)[:-10])
+    assert archive.load_day(DAY) == {1: "<p>1</p>", 2: "<p>2</p>"}
@@ -0,0 +1,39 @@
+import os
+import hashlib
+from src.tools.media_store import MediaStore, sniff_image_extension
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def write_tmp(tmp_path, data: bytes) -> str:
+    path = os.path.join(tmp_path, "download.tmp")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_sniff_image_extension():
+    assert sniff_image_extension(b"\xff\xd8\xff\xe0rest") == ".jpg"
+    assert sniff_image_extension(PNG_BYTES) == ".png"
+    assert sniff_image_extension(b"GIF89a...") == ".gif"
+    assert sniff_image_extension(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == ".webp"
+    assert sniff_image_extension(b'<?xml version="1.0"?><SVG xmlns="...">') == ".svg"
+    assert sniff_image_extension(b"unknown") is None
+
+
+def test_store_file_dedups_same_content_across_extensions(tmp_path):
+    store = MediaStore(str(tmp_path / "media"), str(tmp_path / "media_index.sqlite3"))
+    sha256 = hashlib.sha256(PNG_BYTES).hexdigest()
+    relative_paths = {store.store_file(write_tmp(tmp_path, PNG_BYTES), sha256, ext) for ext in (".jpg", ".jpeg", "")}
+    store.close()
+
+    assert relative_paths == {f"media/{sha256[:2]}/{sha256[2:4]}/{sha256}.png"}
+    assert os.listdir(tmp_path / "media" / sha256[:2] / sha256[2:4]) == [f"{sha256}.png"]
+    assert not os.path.exists(tmp_path / "download.tmp")
+
+
+def test_store_file_keeps_given_extension_for_unknown_content(tmp_path):
+    store = MediaStore(str(tmp_path / "media"), str(tmp_path / "media_index.sqlite3"))
+    sha256 = hashlib.sha256(b"opaque").hexdigest()
+    assert store.store_file(write_tmp(tmp_path, b"opaque"), sha256, ".jpg").endswith(f"{sha256}.jpg")
+    store.close()
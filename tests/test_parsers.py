@@ -0,0 +1,80 @@
+import os
+import pytest
+from bs4 import BeautifulSoup
+from src.tools.parsers import (BeautifulSoupResultParser, LxmlResultParser, ResultRow, parse_last_page_number,
+                               parse_result_rows)
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "search_results_page.html")
+
+
+@pytest.fixture(scope="module")
+def page_html() -> str:
+    with open(FIXTURE_PATH, encoding="utf-8") as f:
+        return f.read()
+
+
+def legacy_parse_rows(html: str):
+    # Bóc tách theo selector td:nth-child(N) cũ trong service.py, làm mốc so sánh cho các parser hiện tại
+    soup = BeautifulSoup(html, 'html.parser')
+    records = []
+    for row in soup.select("table.table tbody tr"):
+        date_text_tag = row.select_one("td:nth-child(7)")
+        brand_name_tag = row.select_one("td:nth-child(4) label")
+        image_tag = row.select_one("td.mau-nhan img")
+        product_group_tags = row.select("td:nth-child(5) span")
+        status_tag = row.select_one("td.trang-thai span.badge")
+        application_number_tag = row.select_one("td:nth-child(8) a")
+        applicant_tag = row.select_one("td:nth-child(9)")
+        representative_tag = row.select_one("td:nth-child(10)")
+        records.append(ResultRow(
+            application_date_text=date_text_tag.text.strip() if date_text_tag else "",
+            brand_name=brand_name_tag.text.strip() if brand_name_tag else "",
+            image_src=image_tag["src"] if image_tag and image_tag.has_attr("src") else None,
+            product_group=", ".join(tag.text.strip() for tag in product_group_tags if tag.text.strip()),
+            status=status_tag.text.strip() if status_tag else "",
+            application_number=application_number_tag.text.strip() if application_number_tag else "",
+            applicant=applicant_tag.text.strip() if applicant_tag else "",
+            representative=representative_tag.text.strip() if representative_tag else "",
+            product_detail_href=application_number_tag.get("href") if application_number_tag else "",
+        ))
+    return records
+
+
+def test_html_parser_matches_legacy_selectors(page_html):
+    rows = BeautifulSoupResultParser().parse_rows(page_html)
+    assert len(rows) == 4
+    assert rows == legacy_parse_rows(page_html)
+
+
+def test_lxml_matches_html_parser(page_html):
+    pytest.importorskip("lxml")
+    assert LxmlResultParser().parse_rows(page_html) == BeautifulSoupResultParser().parse_rows(page_html)
+
+
+def test_parsed_values(page_html):
+    first, second, third, fourth = parse_result_rows(page_html, "html.parser")
+    assert first == ResultRow(
+        application_date_text="01.02.2020",
+        brand_name="PHỞ HÀ & CO",
+        image_src="/uploads/brands/4-2020-00001.png",
+        product_group="43, 30",
+        status="Đang giải quyết",
+        application_number="4-2020-00001",
+        applicant="Công ty TNHH Phở Hà",
+        representative="Văn phòng Luật sư B",
+        product_detail_href="/chi-tiet/4-2020-00001",
+    )
+    assert (second.image_src, second.brand_name, second.status, second.product_detail_href) == (None, "", "", None)
+    assert (third.brand_name, third.status, third.application_number) == ("Cà phê Núi", "Cấp bằng", "")
+    assert (fourth.image_src, fourth.product_group, fourth.applicant) == ("/uploads/brands/4-2020-00004.jpg", "35, 35", "")
+
+
+def test_parse_rows_without_table():
+    assert BeautifulSoupResultParser().parse_rows("<html><body><p>Không có kết quả</p></body></html>") == []
+    assert parse_last_page_number("<html><body></body></html>") is None
+
+
+def test_parse_last_page_number_with_escaped_links(page_html):
+    assert parse_last_page_number(page_html) == 17
+    assert parse_last_page_number('<a href="/search?fd=01.02.2020&amp;p=3">3</a>') == 3
+    assert parse_last_page_number('<a href="/search?fd=01.02.2020&amp;amp;p=9">9</a>') is None
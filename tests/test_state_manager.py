@@ -0,0 +1,30 @@
+import sqlite3
+from src.tools.state_manager import flush_page_states, init_db, load_scrape_state, record_page_metrics, save_page_state
+
+
+def test_buffered_checkpoint_is_flushed(tmp_path):
+    db_path = str(tmp_path / "scraper_state.sqlite3")
+    init_db(db_path)
+    save_page_state(db_path, "brands_2020-01-10_2020-01-10", 3, flush_interval_seconds=3600, max_pending_pages=100)
+    record_page_metrics(db_path, {"day": "2020-01-10", "page": 3, "source": "web", "fetch_seconds": 0.5})
+    assert load_scrape_state(db_path, "brands_2020-01-10_2020-01-10") == 4
+
+    flush_page_states(db_path)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT last_completed_page FROM page_state").fetchall() == [(3,)]
+        assert conn.execute("SELECT page, fetch_seconds FROM page_metrics").fetchall() == [(3, 0.5)]
+    assert load_scrape_state(db_path, "brands_2020-01-10_2020-01-10") == 4
+
+
+def test_failed_flush_keeps_newer_checkpoint(tmp_path):
+    # Không có bảng page_state (chưa init_db) -> ghi lỗi; bộ đệm được trả lại, checkpoint mới hơn không bị ghi đè
+    db_path = str(tmp_path / "missing_tables.sqlite3")
+    save_page_state(db_path, "brands_2020-01-10_2020-01-10", 3, flush_interval_seconds=3600, max_pending_pages=100)
+    flush_page_states(db_path)
+    assert load_scrape_state(db_path, "brands_2020-01-10_2020-01-10") == 4
+
+    init_db(db_path)
+    save_page_state(db_path, "brands_2020-01-10_2020-01-10", 5, flush_interval_seconds=3600, max_pending_pages=100)
+    flush_page_states(db_path)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT last_completed_page FROM page_state").fetchall() == [(5,)]
@@ -0,0 +1,113 @@
+from datetime import date, timedelta
+import pytest
+from src.tools.state_manager import init_db, load_control_state, save_control_state
+from src.tools.work_queue import LocalWorkQueue, WorkUnit, split_page_range
+
+DAY = date(2020, 1, 10)
+
+
+@pytest.fixture
+def state_db_path(tmp_path) -> str:
+    path = str(tmp_path / "scraper_state.sqlite3")
+    init_db(path)
+    return path
+
+
+@pytest.fixture
+def work_queue(state_db_path) -> LocalWorkQueue:
+    return LocalWorkQueue(state_db_path)
+
+
+def watermark(state_db_path: str):
+    return load_control_state(state_db_path)["last_fully_completed_day"]
+
+
+def test_split_page_range_leaves_last_range_open():
+    assert split_page_range(DAY, 21, 65, 20) == [WorkUnit(DAY, 21, 40), WorkUnit(DAY, 41, 60), WorkUnit(DAY, 61, None)]
+    assert split_page_range(DAY, 21, 40, 20) == [WorkUnit(DAY, 21, None)]
+    assert split_page_range(DAY, 21, 21, 20) == [WorkUnit(DAY, 21, None)]
+    assert split_page_range(DAY, 21, 20, 20) == []
+
+
+def test_split_ranges_have_stable_keys():
+    # Chạy tiếp ngày đã chia tạo lại đúng các đơn vị cũ, put_many không thêm bản trùng
+    first, second = split_page_range(DAY, 21, 65, 20), split_page_range(DAY, 21, 65, 20)
+    assert [unit.state_key for unit in first] == [unit.state_key for unit in second]
+    assert WorkUnit(DAY).state_key == "brands_2020-01-10_2020-01-10"
+    assert WorkUnit(DAY, 61, None).state_key == "brands_2020-01-10_2020-01-10_p61-"
+
+
+def test_claim_release_complete_transitions(work_queue):
+    whole_day, later_day = WorkUnit(DAY), WorkUnit(DAY + timedelta(days=1))
+    work_queue.put_many([later_day, whole_day])
+    work_queue.put_many(split_page_range(DAY, 21, 45, 20))
+
+    assert work_queue.claim() == whole_day
+    assert work_queue.claim() == WorkUnit(DAY, 21, 40)
+    work_queue.release(WorkUnit(DAY, 21, 40))
+    assert work_queue.claim() == WorkUnit(DAY, 21, 40)
+    assert work_queue.claim() == WorkUnit(DAY, 41, None)
+    assert work_queue.claim() == later_day
+    assert work_queue.claim() is None
+    assert not work_queue.has_pending()
+
+    for unit in (whole_day, WorkUnit(DAY, 21, 40)):
+        work_queue.complete(unit)
+    assert work_queue.day_has_open_units(DAY)
+    work_queue.complete(WorkUnit(DAY, 41, None))
+    assert not work_queue.day_has_open_units(DAY)
+
+    # Đơn vị đã xong không bị put_many đưa về pending
+    work_queue.put_many([whole_day])
+    assert work_queue.claim() is None
+
+
+def test_failed_units_wait_for_requeue(work_queue):
+    work_queue.put_many([WorkUnit(DAY)])
+    unit = work_queue.claim()
+    work_queue.fail(unit)
+    assert work_queue.claim() is None
+    assert work_queue.requeue_unfinished() == 1
+    assert work_queue.claim() == unit
+
+
+def test_watermark_waits_for_split_day(work_queue, state_db_path):
+    next_day = DAY + timedelta(days=1)
+    work_queue.put_many([WorkUnit(DAY), WorkUnit(DAY, 21, None), WorkUnit(next_day)])
+    for unit in (WorkUnit(DAY), WorkUnit(next_day)):
+        work_queue.claim()
+        work_queue.complete(unit)
+
+    assert work_queue.advance_completed_watermark() is None
+    assert watermark(state_db_path) is None
+
+    work_queue.claim()
+    work_queue.complete(WorkUnit(DAY, 21, None))
+    assert work_queue.advance_completed_watermark() == next_day
+    assert watermark(state_db_path) == next_day.strftime("%Y-%m-%d")
+    assert not work_queue.has_day(DAY) and not work_queue.has_day(next_day)
+
+
+def test_watermark_stops_before_earliest_open_day(work_queue, state_db_path):
+    days = [DAY + timedelta(days=offset) for offset in range(4)]
+    work_queue.put_many([WorkUnit(day) for day in days])
+    for day in (days[0], days[1], days[3]):
+        work_queue.complete(WorkUnit(day))
+
+    assert work_queue.advance_completed_watermark() == days[1]
+    # Ngày đã xong nằm sau mốc vẫn được giữ để không bị gieo lại
+    assert work_queue.has_day(days[3]) and not work_queue.has_day(days[0])
+
+
+def test_watermark_only_moves_forward(work_queue, state_db_path):
+    save_control_state(state_db_path, DAY + timedelta(days=5))
+    work_queue.put_many([WorkUnit(DAY)])
+    work_queue.complete(WorkUnit(DAY))
+    assert work_queue.advance_completed_watermark() is None
+    assert watermark(state_db_path) == (DAY + timedelta(days=5)).strftime("%Y-%m-%d")
+
+
+def test_watermark_ignores_day_before_plan(work_queue, state_db_path):
+    work_queue.put_many([WorkUnit(DAY)])
+    assert work_queue.advance_completed_watermark() is None
+    assert watermark(state_db_path) is None